@@ -1,5 +1,11 @@
+import os
+
+
 # Model config
 INPUT_LAYER_SHAPE = (7, 7, 512)
+# Classifier head on top of the encoder, one of src.model.HEADS
+HEAD = os.environ.get("MODEL_HEAD", "flatten")
+HEAD_UNITS = 256  # width of the hidden dense layer of the head
 
 # Training config
 CLASS_ENCODING = {"Maltese dog": 0, "Afghan hound": 1}
@@ -10,3 +16,15 @@ SPLIT_SEED = 42
 TEST_SIZE = 0.5
 BATCH_SIZE = 32
 EPOCHS = 2
+LEARNING_RATE = 1e-3  # for a single worker, scaled by the number of workers
+
+# Data loading config
+LOADER_WORKERS = os.cpu_count() or 1
+PREFETCH_BATCHES = 16
+
+# Profiling config
+PROFILE_LOG_EVERY = 50  # batches summed up per MLflow log of --profile
+
+# Incremental training config
+DRIFT_THRESHOLD = 0.1  # label distribution distance forcing a full retrain
+INCREMENTAL_STEPS = 50  # maximum fine-tuning steps of an incremental run
@@ -1 +1,16 @@
 INPUT_SIZE = (224, 224)  # Default input size for VGG16
+JPEG_DRAFT = False  # Decode JPEGs at a reduced scale, see img_to_numpy
+# Bumped when decoding changes the pixels of an image, invalidating the caches
+PREPROCESS_VERSION = 2  # 2: EXIF orientation applied to every input
+
+# Decoded image cache
+IMAGE_CACHE_SHARD_SIZE = 256  # images per shard file, ~38MB for 224x224
+IMAGE_CACHE_MAX_BYTES = 10 * 1024 ** 3
+
+# TFRecord export
+TFRECORD_SHARD_SIZE = 1024  # samples per shard
+TFRECORD_COMPRESSION = "GZIP"
+TFRECORD_SHUFFLE_BUFFER = 2048  # samples shuffled across the interleaved shards
+
+# Near-duplicate detection
+DEDUP_MAX_DISTANCE = 6  # bits between the 64-bit dHashes of near duplicates
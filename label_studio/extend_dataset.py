@@ -1,9 +1,24 @@
 import argparse
+import errno
+import fcntl
+import hashlib
+import json
+import os
 import random
 import shutil
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
 from config.model import FNAME_CLASS
+from config.preprocessing import DEDUP_MAX_DISTANCE
+from src.dedup import DuplicateIndex, dhash
+
+
+MANIFEST_NAME = "extend_manifest.json"
+# ioctl request cloning a file on copy-on-write filesystems (btrfs, xfs)
+FICLONE = 0x40049409
 
 
 def check_non_negative(value):
@@ -22,6 +37,103 @@ def check_directory_exists(value):
     return path_value
 
 
+class Manifest:
+    """
+    What previous runs learned about both datasets.
+
+    `current` maps an image of the current dataset to its size and content hash,
+    `sources` caches the listings of the breed folders by folder mtime,
+    `source_hashes` the content hashes of the full dataset images by path and
+    `perceptual_hashes` the dHashes of images by content hash.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        data = json.loads(path.read_text()) if path.exists() else {}
+        self.current: Dict[str, List] = data.get("current", {})
+        self.sources: Dict[str, Dict] = data.get("sources", {})
+        self.source_hashes: Dict[str, List] = data.get("source_hashes", {})
+        self.perceptual_hashes: Dict[str, str] = data.get("perceptual_hashes", {})
+
+    def save(self) -> None:
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(
+            json.dumps(
+                {
+                    "current": self.current,
+                    "sources": self.sources,
+                    "source_hashes": self.source_hashes,
+                    "perceptual_hashes": self.perceptual_hashes,
+                }
+            )
+        )
+        os.replace(tmp_path, self.path)
+
+    def listing(self, directory: Path) -> List[str]:
+        """File names of a folder, listed again only if the folder changed."""
+        mtime_ns = directory.stat().st_mtime_ns
+        cached = self.sources.get(str(directory))
+        if cached is None or cached["mtime_ns"] != mtime_ns:
+            cached = {"mtime_ns": mtime_ns, "files": sorted(os.listdir(directory))}
+            self.sources[str(directory)] = cached
+        return cached["files"]
+
+    def source_hash(self, path: Path) -> str:
+        size = path.stat().st_size
+        cached = self.source_hashes.get(str(path))
+        if cached is None or cached[0] != size:
+            cached = [size, file_hash(path)]
+            self.source_hashes[str(path)] = cached
+        return cached[1]
+
+    def perceptual_hash(self, path: Path, digest: str) -> int:
+        cached = self.perceptual_hashes.get(digest)
+        if cached is None:
+            cached = f"{dhash(path):016x}"
+            self.perceptual_hashes[digest] = cached
+        return int(cached, 16)
+
+    def sync_current(self, cur_data_root: Path, workers: int) -> None:
+        """Match the manifest to the images actually present in the current dataset."""
+        present = {}
+        with os.scandir(cur_data_root) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    present[entry.name] = entry.stat().st_size
+        self.current = {
+            name: entry
+            for name, entry in self.current.items()
+            if present.get(name) == entry[0]
+        }
+        unknown = [name for name in present if name not in self.current]
+        with ThreadPoolExecutor(workers) as executor:
+            hashes = executor.map(file_hash, [cur_data_root / name for name in unknown])
+            for name, digest in zip(unknown, hashes):
+                self.current[name] = [present[name], digest]
+
+
+def file_hash(path: Path) -> str:
+    return hashlib.blake2b(path.read_bytes(), digest_size=16).hexdigest()
+
+
+def transfer(source: Path, destination: Path) -> str:
+    """Hardlink, reflink or, across filesystems, copy an image."""
+    try:
+        os.link(source, destination)
+        return "link"
+    except OSError as e:
+        if e.errno == errno.EEXIST:
+            raise
+    try:
+        with source.open("rb") as src, destination.open("wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return "reflink"
+    except OSError:
+        destination.unlink(missing_ok=True)
+    shutil.copyfile(source, destination)
+    return "copy"
+
+
 def extend_dataset(args: argparse.Namespace) -> None:
     cur_data_root = Path(args.cur_dataset)
     full_data_root = Path(args.full_dataset)
@@ -29,26 +141,86 @@ def extend_dataset(args: argparse.Namespace) -> None:
     if not cur_data_root.exists():
         cur_data_root.mkdir(parents=True)
 
-    # Images we already have
-    cur_files = {x.name for x in cur_data_root.iterdir()}
-    # Folders with breeds of interest
-    breed_dirs = {breed_dir for breed_dir in full_data_root.iterdir() if breed_dir.name.split('-')[0] in FNAME_CLASS}
+    manifest = Manifest(args.manifest or cur_data_root.parent / MANIFEST_NAME)
+    manifest.sync_current(cur_data_root, args.workers)
+    # Images we already have, by name and by content
+    cur_hashes = {digest for _, digest in manifest.current.values()}
+    # and by their looks
+    near_duplicates = None
+    if args.max_distance >= 0:
+        near_duplicates = DuplicateIndex(args.max_distance)
+        with ThreadPoolExecutor(args.workers) as executor:
+            names = list(manifest.current)
+            values = executor.map(
+                lambda name: manifest.perceptual_hash(
+                    cur_data_root / name, manifest.current[name][1]
+                ),
+                names,
+            )
+            for name, value in zip(names, values):
+                near_duplicates.add(name, value)
+
+    # Images of the breeds of interest except the ones we already have
+    breed_dirs = sorted(
+        breed_dir
+        for breed_dir in full_data_root.iterdir()
+        if breed_dir.name.split('-')[0] in FNAME_CLASS
+    )
+    available_breed_images = [
+        breed_dir / name
+        for breed_dir in breed_dirs
+        for name in manifest.listing(breed_dir)
+        if name not in manifest.current
+    ]
 
-    # Images in these folders except the ones we already have
-    available_breed_images = []
-    for breed_dir in breed_dirs:
-        available_breed_images.extend([x for x in breed_dir.iterdir() if x.name not in cur_files])
+    def hashes(image: Path) -> Tuple[str, Optional[int]]:
+        digest = manifest.source_hash(image)
+        if near_duplicates is None:
+            return digest, None
+        return digest, manifest.perceptual_hash(image, digest)
 
-    # Select and copy new images
-    random.shuffle(available_breed_images)
-    new_breed_images = available_breed_images[:args.nmber_of_imgs]
-    for image in new_breed_images:
-        shutil.copy(image, cur_data_root / image.name)
+    # Select new images in random order, skipping duplicates by content
+    # and near duplicates by perceptual hash
+    random.Random(args.seed).shuffle(available_breed_images)
+    new_breed_images = []
+    with ThreadPoolExecutor(args.workers) as executor:
+        start = 0
+        while len(new_breed_images) < args.nmber_of_imgs and start < len(
+            available_breed_images
+        ):
+            candidates = available_breed_images[
+                start : start + args.nmber_of_imgs - len(new_breed_images)
+            ]
+            start += len(candidates)
+            for image, (digest, value) in zip(
+                candidates, executor.map(hashes, candidates)
+            ):
+                if digest in cur_hashes:
+                    continue
+                if value is not None:
+                    if near_duplicates.near(value):
+                        continue
+                    near_duplicates.add(image.name, value)
+                cur_hashes.add(digest)
+                new_breed_images.append((image, digest))
 
-    print(f"{len(new_breed_images)} images copied")
+        methods = Counter(
+            executor.map(
+                lambda item: transfer(item[0], cur_data_root / item[0].name),
+                new_breed_images,
+            )
+        )
+    for image, digest in new_breed_images:
+        manifest.current[image.name] = [manifest.source_hashes[str(image)][0], digest]
+    manifest.save()
 
+    print(
+        f"{len(new_breed_images)} images copied ({dict(methods)}), "
+        f"{start - len(new_breed_images)} duplicates skipped"
+    )
 
-def get_args() -> argparse.Namespace:
+
+def get_args(provided_args: Optional[List[str]] = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "-d",
@@ -71,8 +243,35 @@ def get_args() -> argparse.Namespace:
         type=check_non_negative,
         help="How many new images to add from dataset into current data",
     )
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        type=Path,
+        help=f"Path to the dataset manifest, {MANIFEST_NAME} "
+        "next to the current dataset folder by default",
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        type=int,
+        help="Seed of the image sampling, random if not set",
+    )
+    parser.add_argument(
+        "--max_distance",
+        default=DEDUP_MAX_DISTANCE,
+        type=int,
+        help="Skip images whose perceptual hash is at most this many bits away "
+        "from the one of a current image, -1 to skip exact duplicates only",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        default=16,
+        type=int,
+        help="Number of parallel file transfers",
+    )
 
-    args = parser.parse_args()
+    args = parser.parse_args(provided_args)
     return args
 
 
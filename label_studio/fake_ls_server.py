@@ -0,0 +1,128 @@
+"""
+Minimal fake of the Label Studio API used by `launch_ls.py`, to run it offline:
+
+    LS_PORT=8089 python label_studio/launch_ls.py -r /tmp/project \
+        --command "python label_studio/fake_ls_server.py" -- --port 8089
+
+Every progress check annotates `--annotate_per_poll` more tasks.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+
+class FakeLabelStudio:
+    def __init__(self, tasks: int, annotate_per_poll: int) -> None:
+        self.tasks = tasks
+        self.annotate_per_poll = annotate_per_poll
+        self.annotated = 0
+        self.storages: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def progress(self) -> dict:
+        with self.lock:
+            self.annotated = min(self.annotated + self.annotate_per_poll, self.tasks)
+            return {
+                "num_tasks_with_annotations": self.annotated,
+                "task_number": self.tasks,
+            }
+
+    def export_chunks(self):
+        """Tasks in the Label Studio JSON export format, serialized one by one."""
+        yield b"["
+        for i in range(self.tasks):
+            task = {
+                "id": i + 1,
+                "data": {"image": f"/data/local-files/?d=Images/n02085936_{i}.jpg"},
+                "annotations": [
+                    {"result": [{"value": {"choices": ["Maltese dog"]}}]}
+                ],
+            }
+            yield (b"," if i else b"") + json.dumps(task).encode()
+        yield b"]"
+
+
+def make_handler(ls: FakeLabelStudio) -> type:
+    class FakeHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self) -> None:
+            path = self.path.split("?")[0].rstrip("/")
+            if path == "/health":
+                self._json({"status": "UP"})
+            elif path == "/api/projects/1":
+                self._json(ls.progress())
+            elif path == "/api/projects/1/export":
+                self._stream(ls.export_chunks())
+            elif path.startswith("/api/storages/"):
+                storage_type = path.split("/")[3]
+                if storage_type in ls.storages:
+                    self._json(ls.storages[storage_type])
+                else:
+                    self._json({"detail": "Not found."}, status=404)
+            else:
+                self._json({"detail": "Not found."}, status=404)
+
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            path = self.path.rstrip("/")
+            parts = path.split("/")
+            if path.startswith("/api/storages/") and len(parts) == 4:
+                ls.storages[parts[3]] = dict(json.loads(body or b"{}"), id=1)
+                self._json(ls.storages[parts[3]], status=201)
+            elif path.startswith("/api/storages/") and path.endswith("/sync"):
+                self._json({"id": 1})
+            else:
+                self._json({"detail": "Not found."}, status=404)
+
+        def _json(self, data: dict, status: int = 200) -> None:
+            response = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def _stream(self, chunks) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for chunk in chunks:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    return FakeHandler
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fake Label Studio API server")
+    parser.add_argument("--port", default=8080, type=int)
+    parser.add_argument("--tasks", default=100, type=int, help="Number of tasks")
+    parser.add_argument(
+        "--annotate_per_poll",
+        default=10,
+        type=int,
+        help="Tasks annotated between two progress checks",
+    )
+    parser.add_argument(
+        "--startup_delay",
+        default=1.0,
+        type=float,
+        help="Seconds before the server starts answering",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    time.sleep(args.startup_delay)
+    ls = FakeLabelStudio(args.tasks, args.annotate_per_poll)
+    server = ThreadingHTTPServer(("localhost", args.port), make_handler(ls))
+    server.serve_forever()
@@ -1,20 +1,97 @@
 import argparse
 import logging
 import asyncio
+import functools
 import os
+import shlex
+import tempfile
 
 import requests
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 logging.basicConfig(level=logging.INFO)
 
 AUTH = {"Authorization": f"Token {os.environ.get('LS_TOKEN')}"}
-LS_API_URL = f"http://localhost:{os.environ.get('LS_PORT')}/api"
+LS_URL = f"http://localhost:{os.environ.get('LS_PORT')}"
+
+# Seconds to wait for Label Studio to report healthy
+STARTUP_TIMEOUT = float(os.environ.get("LS_STARTUP_TIMEOUT", 300))
+# Bounds of the delay between labeling progress checks, in seconds
+POLL_MIN_INTERVAL = float(os.environ.get("LS_POLL_MIN_INTERVAL", 1))
+POLL_MAX_INTERVAL = float(os.environ.get("LS_POLL_MAX_INTERVAL", 60))
+REQUEST_TIMEOUT = 30
+EXPORT_CHUNK_SIZE = 1024 * 1024
+
+
+class LabelStudioClient:
+    """
+    Label Studio API calls sharing one pooled HTTP session.
+
+    Requests run in the default executor, so they do not block the event loop.
+    """
+
+    def __init__(self, url: str = LS_URL) -> None:
+        self.url = url
+        self.api_url = f"{url}/api"
+        self.session = requests.Session()
+        self.session.headers.update(AUTH)
+
+    async def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+        call = functools.partial(
+            self.session.request, method, f"{self.api_url}{path}", **kwargs
+        )
+        return await asyncio.get_running_loop().run_in_executor(None, call)
+
+    async def wait_healthy(
+        self, ls_proc: asyncio.subprocess.Process, timeout: float = STARTUP_TIMEOUT
+    ) -> None:
+        """Poll `/health` with exponential backoff until Label Studio is up."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        delay = 0.25
+        while True:
+            _check_running(ls_proc)
+            try:
+                health = functools.partial(
+                    self.session.get, f"{self.url}/health", timeout=5
+                )
+                response = await loop.run_in_executor(None, health)
+                if response.ok:
+                    return
+            except requests.ConnectionError:
+                pass
+            if loop.time() + delay > deadline:
+                raise TimeoutError(f"Label Studio is not up after {timeout}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5)
+
+    async def labeling_progress(self) -> Tuple[int, int]:
+        response = await self.request("GET", "/projects/1/")
+        response.raise_for_status()
+        project = response.json()
+        return project["num_tasks_with_annotations"], project["task_number"]
+
+    async def export(self, results_file: Path) -> None:
+        """
+        Stream the JSON export into a temporary file, renamed to `results_file`
+        once complete, so a failure never leaves a partial export behind.
+        """
+        response = await self.request(
+            "GET", "/projects/1/export?exportType=JSON", stream=True
+        )
+        response.raise_for_status()
+        await asyncio.get_running_loop().run_in_executor(
+            None, _write_stream, response, results_file
+        )
+
+    def close(self) -> None:
+        self.session.close()
 
 
 def main(args: argparse.Namespace) -> None:
-    cmd = ["label-studio"] + args.label_studio_args
+    cmd = shlex.split(args.command) + args.label_studio_args
     cmd_str = ' '.join(cmd)
     logging.info(f"Launching label studio with cmd: '{cmd_str}' ")
     return_code = asyncio.run(
@@ -50,84 +127,108 @@ async def _run_label_studio(
     logging.info('Starting Label Studio...')
     # use start_new_session=True not to send KeyboardInterrupt to subprocess
     ls_proc = await asyncio.create_subprocess_exec(*cmd, start_new_session=True)
-    await asyncio.sleep(10)
-
-    response = requests.get(url=f"{LS_API_URL}/storages/{storage_type}/1",
-                            headers=AUTH)
-    if response.status_code == 404:
-        logging.info(f"Creating {storage_type} storage via Label Studio API")
-        # Create local storage if it doesn't exist
-        data = {
-            "project": 1,
-            "title": storage_type,
-            "use_blob_urls": True,
-        }
-        if use_s3:
-            data.update({
-                "bucket": bucket_name,
-                "prefix": "images/",
-                "region_name": region_name,
-                "s3_endpoint": endpoint_url,
-                "aws_access_key_id": aws_access_key_id,
-                "aws_secret_access_key": aws_secret_access_key,
-                "presign_ttl": 60,
-                "recursive_scan": False,
-            })
-        else:
-            data.update({
-                "path": os.environ.get('DATA_PATH'),
-            })
-        requests.post(url=f"{LS_API_URL}/storages/{storage_type}",
-                      json=data,
-                      headers=AUTH)
-
-    # Sync tasks from local storage
-    logging.info("Syncing tasks")
-    requests.post(url=f"{LS_API_URL}/storages/{storage_type}/1/sync",
-                  json={"project": 1},
-                  headers=AUTH)
-
-    is_last_iteration = False
+    client = LabelStudioClient()
+    try:
+        await client.wait_healthy(ls_proc)
+
+        response = await client.request("GET", f"/storages/{storage_type}/1")
+        if response.status_code == 404:
+            logging.info(f"Creating {storage_type} storage via Label Studio API")
+            # Create local storage if it doesn't exist
+            data = {
+                "project": 1,
+                "title": storage_type,
+                "use_blob_urls": True,
+            }
+            if use_s3:
+                data.update({
+                    "bucket": bucket_name,
+                    "prefix": "images/",
+                    "region_name": region_name,
+                    "s3_endpoint": endpoint_url,
+                    "aws_access_key_id": aws_access_key_id,
+                    "aws_secret_access_key": aws_secret_access_key,
+                    "presign_ttl": 60,
+                    "recursive_scan": False,
+                })
+            else:
+                data.update({
+                    "path": os.environ.get('DATA_PATH'),
+                })
+            await client.request("POST", f"/storages/{storage_type}", json=data)
+
+        # Sync tasks from local storage
+        logging.info("Syncing tasks")
+        await client.request(
+            "POST", f"/storages/{storage_type}/1/sync", json={"project": 1}
+        )
+
+        await _wait_labeling_finished(client, ls_proc)
+        logging.warning(
+            "All tasks are finished! Uploading labels and terminating Label-studio."
+        )
+        await _save_labeling_results(client, project_root)
+    finally:
+        client.close()
+        if ls_proc.returncode is None:
+            ls_proc.terminate()
+        await ls_proc.wait()
+
+
+async def _wait_labeling_finished(
+    client: LabelStudioClient, ls_proc: asyncio.subprocess.Process
+) -> None:
+    """
+    Poll the labeling progress, backing off exponentially while nothing
+    changes and checking again soon after every new annotation.
+    """
+    delay = POLL_MIN_INTERVAL
+    last_annotated = None
     while True:
         try:
-            if _all_tasks_finished() or is_last_iteration:
-                logging.warning(
-                    "All tasks are finished! Uploading labels and terminating Label-studio."
-                )
-                _save_labeling_results(project_root)
-                if ls_proc.returncode is None:
-                    ls_proc.terminate()
-                await ls_proc.wait()
-                is_last_iteration = True
+            annotated, total = await client.labeling_progress()
+            if annotated >= total:
+                return
+            if annotated != last_annotated:
+                logging.info(f"{annotated}/{total} tasks annotated")
+                last_annotated = annotated
+                delay = POLL_MIN_INTERVAL
             else:
-                await asyncio.sleep(3)
-            if is_last_iteration:
-                break
+                delay = min(delay * 2, POLL_MAX_INTERVAL)
+            _check_running(ls_proc)
+            await asyncio.sleep(delay)
         except KeyboardInterrupt:
             logging.info("Interrupted")
-            is_last_iteration = True
+            return
 
 
-def _all_tasks_finished() -> bool:
-    response = requests.get(url=f"{LS_API_URL}/projects/1/",
-                            json={
-                                "project": 1,
-                            },
-                            headers=AUTH).json()
-    num_tasks_with_annotations = response['num_tasks_with_annotations']
-    task_number = response['task_number']
-    return num_tasks_with_annotations >= task_number
+def _check_running(ls_proc: asyncio.subprocess.Process) -> None:
+    if ls_proc.returncode is not None:
+        raise RuntimeError(f"Label Studio exited with code {ls_proc.returncode}")
 
 
-def _save_labeling_results(project_root: Path) -> None:
-    response = requests.get(f"{LS_API_URL}/projects/1/export?exportType=JSON",
-                            headers=AUTH)
-    results_file = project_root / "data" / "result.json"
+def _write_stream(response: requests.Response, results_file: Path) -> None:
     results_folder = results_file.parent
     results_folder.mkdir(parents=True, exist_ok=True)
     logging.info(f"Saving results to {results_file}")
-    with results_file.open("wb") as fd:
-        fd.write(response.content)
+    fd, tmp_path = tempfile.mkstemp(dir=results_folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            for chunk in response.iter_content(EXPORT_CHUNK_SIZE):
+                tmp_file.write(chunk)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, results_file)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    finally:
+        response.close()
+
+
+async def _save_labeling_results(client: LabelStudioClient, project_root: Path) -> None:
+    await client.export(project_root / "data" / "result.json")
 
 
 def get_args() -> argparse.Namespace:
@@ -143,6 +244,12 @@ def get_args() -> argparse.Namespace:
         type=Path,
         help="Project root path",
     )
+    parser.add_argument(
+        "--command",
+        default="label-studio",
+        help="Command starting Label Studio, "
+        "e.g. 'python label_studio/fake_ls_server.py' to run offline",
+    )
     parser.add_argument(
         "--bucket",
         type=str,
@@ -1,17 +1,71 @@
-import pathlib
-import os
-import logging
 import time
-from typing import Union, Iterable, Dict, List
 
-import numpy as np
-import tensorflow as tf
+IMPORTS_STARTED = time.perf_counter()
 
-from config.preprocessing import INPUT_SIZE
-from config.model import ENCODING_CLASS
-from src.preprocessing import img_to_numpy, _preprocess
+import pathlib  # noqa: E402
+import os  # noqa: E402
+import logging  # noqa: E402
+import threading  # noqa: E402
+from typing import Any, Union, Iterable, Dict, List, NamedTuple, Optional  # noqa: E402
+
+import numpy as np  # noqa: E402
+
+from config.preprocessing import INPUT_SIZE  # noqa: E402
+from config.model import ENCODING_CLASS  # noqa: E402
+from src.preprocessing import decode_image, resize_image, _preprocess  # noqa: E402
+from src.batching import MicroBatcher  # noqa: E402
+from src.prediction_cache import PredictionCache  # noqa: E402
+from src.metrics import StageTimings  # noqa: E402
+from src.inference import BACKEND_MODEL_PATTERNS, load_backend  # noqa: E402
+
+IMPORTS_TIME = time.perf_counter() - IMPORTS_STARTED
 
 MOUNTED_MODELS_ROOT = pathlib.Path("/storage")
+# "keras" runs the .h5 model, "tflite" the one exported by src/export_tflite.py
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "keras")
+TFLITE_THREADS = int(os.environ.get("TFLITE_THREADS", 0)) or None
+# How deep to look for a model file under MODEL_PATH or MOUNTED_MODELS_ROOT
+MODEL_SEARCH_DEPTH = int(os.environ.get("MODEL_SEARCH_DEPTH", 6))
+# Seconds between checks for a new model file, 0 disables hot reloading
+MODEL_RELOAD_INTERVAL_S = float(os.environ.get("MODEL_RELOAD_INTERVAL_S", 30))
+# Concurrent requests are run through the model together,
+# batches are closed when full or after waiting for the max wait time
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 16))
+MAX_BATCH_WAIT_MS = float(os.environ.get("MAX_BATCH_WAIT_MS", 5))
+# Predictions of repeated payloads are served from an LRU cache, 0 disables it
+PREDICTION_CACHE_ENTRIES = int(os.environ.get("PREDICTION_CACHE_ENTRIES", 10000))
+PREDICTION_CACHE_BYTES = int(os.environ.get("PREDICTION_CACHE_BYTES", 16 * 1024 ** 2))
+# Batch size of the model call run before the replica gets ready, 0 disables it
+WARMUP_BATCH_SIZE = int(os.environ.get("WARMUP_BATCH_SIZE", MAX_BATCH_SIZE))
+# Stages of a prediction with latency histograms reported in metrics():
+# "forward" is seen from the request and includes waiting for a batch,
+# "model_batch" is the model call of a whole batch
+STAGES = (
+    "decode",
+    "preprocess",
+    "forward",
+    "model_batch",
+    "postprocess",
+    "predict",
+    "explain",
+)
+# SHAP explanations, enabled when the background set written by src/explain.py
+# is found at EXPLAIN_BACKGROUND or next to the model as background.npy
+EXPLAIN_BACKGROUND = os.environ.get("EXPLAIN_BACKGROUND")
+# Model evaluations per explanation, lowered to fit the time budget (0 - no budget)
+EXPLAIN_MAX_EVALS = int(os.environ.get("EXPLAIN_MAX_EVALS", 500))
+EXPLAIN_TIME_BUDGET_MS = float(os.environ.get("EXPLAIN_TIME_BUDGET_MS", 2000))
+EXPLAIN_BATCH_SIZE = int(os.environ.get("EXPLAIN_BATCH_SIZE", 64))
+
+
+class LoadedModel(NamedTuple):
+    """A model with everything derived from it, swapped in as a whole."""
+
+    path: pathlib.Path
+    model_id: str
+    version: float  # mtime of the model file
+    backend: Any
+    explainer: Any
 
 
 class SeldonModel:
@@ -29,11 +83,35 @@ class SeldonModel:
         self.logger = logging.getLogger(__name__)
         self.last_prediction_time = 0.0
         self.predictions_made = 0
+        self.timings = StageTimings(STAGES)
+        self.prediction_cache = PredictionCache(
+            PREDICTION_CACHE_ENTRIES, PREDICTION_CACHE_BYTES
+        )
+
+        self.reload_failures = 0
 
+        started = time.perf_counter()
         model_path = self._find_model()
-        self.logger.info(f"Loading model at '{str(model_path)}'")
-        self.model: tf.keras.models.Sequential = tf.keras.models.load_model(model_path)
-        self.logger.info("Model loaded.")
+        found = time.perf_counter()
+        # requests read it once, so they finish on the model they started with
+        self.active = self._load(model_path)
+        self.prediction_cache.set_model(self.active.model_id)
+        self.batcher = MicroBatcher(self._forward, MAX_BATCH_SIZE, MAX_BATCH_WAIT_MS)
+        self.logger.info(
+            "Startup took %.2fs: imports %.2fs, model lookup %.2fs, model load %.2fs",
+            IMPORTS_TIME + time.perf_counter() - started,
+            IMPORTS_TIME,
+            found - started,
+            time.perf_counter() - found,
+        )
+        if MODEL_RELOAD_INTERVAL_S > 0:
+            threading.Thread(
+                target=self._watch_model, name="model-watcher", daemon=True
+            ).start()
+
+    @property
+    def model(self):
+        return self.active.backend
 
     def predict(
         self, X: np.ndarray, names: Iterable[str], meta: Dict = None
@@ -46,13 +124,38 @@ class SeldonModel:
         X : array-like
         feature_names : array of feature names (optional)
         """
-        pred_started = self._cur_time_millisecs()
+        pred_started = time.perf_counter()
         self.logger.debug("Predict called - will run idenity function")
-        result = self._predict(X, names, meta)
-        self.last_prediction_time = self._cur_time_millisecs() - pred_started
+        active = self.active
+        cache_key = self.prediction_cache.key(X)
+        result = None
+        if cache_key is not None:
+            result = self.prediction_cache.get(cache_key)
+        if result is None:
+            result = self._predict(X, names, meta, active)
+            if cache_key is not None:
+                self.prediction_cache.put(cache_key, result, active.model_id)
+        self.last_prediction_time = (time.perf_counter() - pred_started) * 1000
+        self.timings.observe("predict", self.last_prediction_time)
         self.predictions_made += 1
         return result
 
+    def explain(
+        self, X: np.ndarray, names: Iterable[str], meta: Dict = None
+    ) -> np.ndarray:
+        """
+        Return the SHAP attribution of every pixel of the image
+        to the predicted class, as a 224x224 array.
+        """
+        active = self.active
+        if active.explainer is None:
+            raise RuntimeError("Explanations are disabled, see the model load logs")
+        with self.timings.time("explain"):
+            img = X if isinstance(X, np.ndarray) else decode_image(X, INPUT_SIZE)
+            x = img if isinstance(img, np.ndarray) else resize_image(img, INPUT_SIZE)
+            output = int(np.argmax(active.backend(_preprocess(x))[0]))
+            return active.explainer(x, output)
+
     def metrics(self) -> List[Dict[str, Union[str, int, float]]]:
         return [
             # a counter which will increase by the given value
@@ -67,30 +170,193 @@ class SeldonModel:
                 "key": "last_prediction_time",
                 "value": self.last_prediction_time,
             },
+            {
+                "type": "GAUGE",
+                "key": "prediction_cache_hits",
+                "value": self.prediction_cache.hits,
+            },
+            {
+                "type": "GAUGE",
+                "key": "prediction_cache_misses",
+                "value": self.prediction_cache.misses,
+            },
+            {
+                "type": "GAUGE",
+                "key": "prediction_cache_evictions",
+                "value": self.prediction_cache.evictions,
+            },
+            # mtime of the model file being served
+            {
+                "type": "GAUGE",
+                "key": "model_version",
+                "value": self.active.version,
+            },
+            {
+                "type": "GAUGE",
+                "key": "model_reload_failures",
+                "value": self.reload_failures,
+            },
+            *self.timings.metrics(),
         ]
 
     def _find_model(self) -> pathlib.Path:
         env_path = os.environ.get("MODEL_PATH")
+        pattern = BACKEND_MODEL_PATTERNS[INFERENCE_BACKEND]
         if not env_path:
             # https://github.com/neuro-inc/neuro-extras/blob/master/neuro_extras/seldon.py#L117
-            model_path = list(MOUNTED_MODELS_ROOT.glob("**/*.h5"))[0]
+            model_path = _find_shallowest(
+                MOUNTED_MODELS_ROOT, pattern, MODEL_SEARCH_DEPTH
+            )
         else:
             model_path = pathlib.Path(env_path)
             if not model_path.is_file():
-                model_path = list(model_path.glob("**/*.h5"))[0]
+                model_path = _find_shallowest(model_path, pattern, MODEL_SEARCH_DEPTH)
 
+        if model_path is None:
+            raise FileNotFoundError(
+                f"No model found at {env_path or MOUNTED_MODELS_ROOT}"
+            )
         return model_path
 
-    def _cur_time_millisecs(self) -> int:
-        return int(round(time.time() * 1000))
+    def _load(self, model_path: pathlib.Path) -> LoadedModel:
+        started = time.perf_counter()
+        self.logger.info("Loading model at '%s'", model_path)
+        # taken before reading, so a file replaced meanwhile is loaded again
+        model_id = self._model_id(model_path)
+        version = model_path.stat().st_mtime
+        # the batcher sends batches of 1 to MAX_BATCH_SIZE images, padded to either
+        backend = load_backend(
+            INFERENCE_BACKEND, model_path, TFLITE_THREADS, (1, MAX_BATCH_SIZE)
+        )
+        loaded = time.perf_counter()
+        self._warmup(backend)
+        warmed_up = time.perf_counter()
+        explainer = self._load_explainer(backend, model_path)
+        self.logger.info(
+            "Model loaded: load %.2fs, warmup %.2fs, explainer %.2fs",
+            loaded - started,
+            warmed_up - loaded,
+            time.perf_counter() - warmed_up,
+        )
+        return LoadedModel(model_path, model_id, version, backend, explainer)
+
+    def _watch_model(self) -> None:
+        """
+        Load a new model file in the background and swap it in once warmed up.
+        A file is only loaded once it is unchanged between two checks,
+        so it is not read while still being written.
+        """
+        candidate = failed = None
+        while True:
+            time.sleep(MODEL_RELOAD_INTERVAL_S)
+            try:
+                model_path = self._find_model()
+                model_id = self._model_id(model_path)
+                if model_id in (self.active.model_id, failed):
+                    continue
+                if model_id != candidate:
+                    candidate = model_id
+                    continue
+                loaded = self._load(model_path)
+            except Exception:
+                self.reload_failures += 1
+                failed = candidate
+                self.logger.exception("Model reload failed, keeping the current one")
+                continue
+            self.active = loaded
+            self.prediction_cache.set_model(loaded.model_id)
+            self.logger.info("Switched to the model at '%s'", model_path)
+
+    def _warmup(self, backend) -> None:
+        """Trace the model for the single image and the full batch inputs."""
+        for batch_size in sorted({1, WARMUP_BATCH_SIZE}):
+            if batch_size > 0:
+                backend(np.zeros((batch_size, *INPUT_SIZE, 3), dtype=np.float32))
+
+    def _load_explainer(self, backend, model_path: pathlib.Path):
+        background_path = pathlib.Path(
+            EXPLAIN_BACKGROUND or model_path.parent / "background.npy"
+        )
+        if not background_path.is_file():
+            self.logger.info("No %s, explanations are disabled", background_path)
+            return None
+        # shap is imported only when explanations are enabled
+        try:
+            import shap  # noqa: F401
+        except ImportError:
+            self.logger.error(
+                "Found %s but shap is not installed, explanations are disabled; "
+                "build the image with --build-arg EXPLAIN=1",
+                background_path,
+            )
+            return None
+        from src.explain import ImageExplainer
+
+        try:
+            return ImageExplainer(
+                backend,
+                np.load(background_path),
+                EXPLAIN_MAX_EVALS,
+                EXPLAIN_BATCH_SIZE,
+                EXPLAIN_TIME_BUDGET_MS,
+            )
+        except ValueError as e:
+            self.logger.error("Explanations are disabled: %s", e)
+            return None
+
+    def _model_id(self, model_path: pathlib.Path) -> str:
+        stat = model_path.stat()
+        return f"{model_path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def _predict(
+        self,
+        X: np.ndarray,
+        names: Iterable[str],
+        meta: Dict = None,
+        active: Optional[LoadedModel] = None,
+    ) -> str:
+        active = active or self.active
+        img = X
+        if not isinstance(X, np.ndarray):
+            with self.timings.time("decode"):
+                img = decode_image(X, target_size=INPUT_SIZE)
+        with self.timings.time("preprocess"):
+            x = img if isinstance(img, np.ndarray) else resize_image(img, INPUT_SIZE)
+            x = _preprocess(x)
+        with self.timings.time("forward"):
+            model_prediction = self.batcher(x[0], active.backend)
+        with self.timings.time("postprocess"):
+            model_prediction: list = model_prediction.tolist()
+            predict_encoding = model_prediction.index(max(model_prediction))
+            return ENCODING_CLASS.get(predict_encoding, "")
 
-    def _predict(self, X: np.ndarray, names: Iterable[str], meta: Dict = None) -> str:
-        x = img_to_numpy(X, target_size=INPUT_SIZE)
-        x = _preprocess(x)
-        model_prediction: tf.Tensor = self.model(x)
-        model_prediction: list = model_prediction.numpy().flatten().tolist()
-        predict_encoding = model_prediction.index(max(model_prediction))
-        return ENCODING_CLASS.get(predict_encoding, "")
+    def _forward(self, x: np.ndarray, backend) -> np.ndarray:
+        with self.timings.time("model_batch"):
+            return backend(x)
+
+
+def _find_shallowest(
+    root: pathlib.Path, pattern: str, depth: int
+) -> Optional[pathlib.Path]:
+    """
+    Breadth-first search for a file matching `pattern`, stops at the first level
+    with a match instead of walking the whole tree. Of several matches
+    the most recently modified one is returned.
+    """
+    level = [root]
+    for _ in range(depth + 1):
+        matches = [
+            path
+            for directory in level
+            for path in directory.glob(pattern)
+            if path.is_file()
+        ]
+        if matches:
+            return max(matches, key=lambda path: (path.stat().st_mtime_ns, str(path)))
+        level = sorted(
+            path for directory in level for path in directory.iterdir() if path.is_dir()
+        )
+    return None
 
 
 seldon_model = SeldonModel
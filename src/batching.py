@@ -0,0 +1,80 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, List, Tuple
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent single-sample calls into batched calls of `fn`.
+
+    A batch is run as soon as `max_batch_size` samples are queued
+    or `max_wait_ms` passed since the first of them arrived, so batching adds
+    at most `max_wait_ms` to the latency of a request.
+    Extra call arguments are passed on to `fn`, samples called with different
+    ones are run in separate batches.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[..., np.ndarray],
+        max_batch_size: int,
+        max_wait_ms: float,
+    ) -> None:
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[Tuple[np.ndarray, tuple, Future]]" = queue.Queue()
+        if self.max_batch_size > 1:
+            threading.Thread(
+                target=self._run, name="micro-batcher", daemon=True
+            ).start()
+
+    def __call__(self, x: np.ndarray, *args: Hashable) -> np.ndarray:
+        """Run `fn` on a single sample `x` (without the batch axis)."""
+        if self.max_batch_size <= 1:
+            return self.fn(x[np.newaxis], *args)[0]
+        future: Future = Future()
+        self._queue.put((x, args, future))
+        return future.result()
+
+    def _run(self) -> None:
+        while True:
+            groups: Dict[tuple, list] = {}
+            for item in self._collect():
+                groups.setdefault(item[1], []).append(item)
+            for args, items in groups.items():
+                self._run_batch(items, args)
+
+    def _run_batch(
+        self, items: List[Tuple[np.ndarray, tuple, Future]], args: tuple
+    ) -> None:
+        try:
+            outputs = self.fn(np.stack([x for x, _, _ in items]), *args)
+        except Exception as e:
+            logger.exception("Batched call failed")
+            for _, _, future in items:
+                future.set_exception(e)
+            return
+        for (_, _, future), output in zip(items, outputs):
+            future.set_result(output)
+
+    def _collect(self) -> List[Tuple[np.ndarray, tuple, Future]]:
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return items
@@ -0,0 +1,314 @@
+"""
+Offline benchmarks of the preprocessing, dataset and serving hot paths.
+
+Runs on synthetic JPEGs and a tiny stand-in model with the same input/output
+contract as `get_model`, so neither the dataset nor the ImageNet weights
+are needed. Results are written as JSON, pass a previous result as
+`--baseline` to fail on throughput regressions.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import pathlib
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from config.model import BATCH_SIZE, CLASS_ENCODING, FNAME_CLASS
+from config.preprocessing import INPUT_SIZE
+from src.batching import MicroBatcher
+
+
+def make_images(
+    root: pathlib.Path, count: int, size: List[int], seed: int
+) -> List[pathlib.Path]:
+    """Write `count` smooth random JPEGs named like Stanford Dogs images."""
+    rng = np.random.RandomState(seed)
+    file_ids = list(FNAME_CLASS)
+    paths = []
+    for i in range(count):
+        low_res = rng.randint(
+            0, 256, size=(size[1] // 16, size[0] // 16, 3), dtype=np.uint8
+        )
+        img = Image.fromarray(low_res).resize(tuple(size), Image.BILINEAR)
+        path = root / f"{file_ids[i % len(file_ids)]}_{i}.jpg"
+        img.save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def make_export(path: pathlib.Path, image_names: List[str], tasks: int) -> None:
+    """Write a Label Studio JSON export with `tasks` annotated tasks."""
+    export = []
+    for i in range(tasks):
+        name = image_names[i % len(image_names)]
+        label = FNAME_CLASS[name.split("_")[0]]
+        export.append(
+            {
+                "id": i,
+                "data": {"image": f"/data/local-files/?d=Images/{name}"},
+                "annotations": [
+                    {
+                        "id": i,
+                        "created_at": "2021-01-01T00:00:00.000000Z",
+                        "result": [
+                            {
+                                "from_name": "choice",
+                                "to_name": "image",
+                                "type": "choices",
+                                "value": {"choices": [label]},
+                            }
+                        ],
+                    }
+                ],
+            }
+        )
+    path.write_text(json.dumps(export))
+
+
+def make_model(path: pathlib.Path) -> None:
+    """Save a tiny model taking `INPUT_SIZE` images and returning 2 class scores."""
+    from keras import layers, models
+
+    model = models.Sequential(
+        [
+            layers.Conv2D(
+                8, 3, strides=4, activation="relu", input_shape=(*INPUT_SIZE, 3)
+            ),
+            layers.GlobalAveragePooling2D(),
+            layers.Dense(len(CLASS_ENCODING), activation="softmax"),
+        ]
+    )
+    model.save(path)
+
+
+def measure(
+    fn: Callable[[], Any], repeats: int, items_per_call: int = 1, warmup: int = 1
+) -> Dict[str, Any]:
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started)
+    return _summary(latencies, items_per_call, sum(latencies))
+
+
+def measure_concurrent(
+    fn: Callable[[], Any], repeats: int, concurrency: int
+) -> Dict[str, Any]:
+    def timed_call(_: int) -> float:
+        started = time.perf_counter()
+        fn()
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(timed_call, range(concurrency)))
+        started = time.perf_counter()
+        latencies = list(executor.map(timed_call, range(repeats)))
+        wall_time = time.perf_counter() - started
+    result = _summary(latencies, 1, wall_time)
+    result["concurrency"] = concurrency
+    return result
+
+
+def _summary(
+    latencies: List[float], items_per_call: int, wall_time: float
+) -> Dict[str, Any]:
+    latencies_ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        "calls": len(latencies),
+        "items_per_call": items_per_call,
+        "throughput_per_s": len(latencies) * items_per_call / wall_time,
+        "latency_ms": {
+            "mean": float(latencies_ms.mean()),
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+        },
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    # measure the real inference path, not the prediction cache
+    os.environ.setdefault("PREDICTION_CACHE_ENTRIES", "0")
+    os.environ.setdefault("MAX_BATCH_SIZE", "1")
+
+    from src.dataset import DogsDataset
+    from src.ls_export import iter_labeled
+    from src.preprocessing import img_to_numpy, split_json
+
+    results: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = pathlib.Path(tmp_dir)
+        images_dir = root / "Images"
+        images_dir.mkdir()
+        paths = make_images(images_dir, args.images, args.image_size, args.seed)
+        payloads = [path.read_bytes() for path in paths]
+
+        cycle = iter(range(sys.maxsize))
+        results["img_to_numpy"] = measure(
+            lambda: img_to_numpy(
+                paths[next(cycle) % len(paths)], target_size=INPUT_SIZE
+            ),
+            args.repeats,
+        )
+
+        export_path = root / "result.json"
+        make_export(export_path, [path.name for path in paths], args.tasks)
+        results["parse_export"] = measure(
+            lambda: list(iter_labeled(export_path)),
+            max(args.repeats // 10, 1),
+            args.tasks,
+        )
+        # the first call writes the index, the measured ones load it
+        results["split_json"] = measure(
+            lambda: split_json(export_path), max(args.repeats // 10, 1), args.tasks
+        )
+
+        images, labels = split_json(export_path)
+        dataset = DogsDataset(
+            images_dir, images, labels, CLASS_ENCODING, seed=args.seed
+        )
+        batches = iter(range(sys.maxsize))
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results["dataset_getitem"] = measure(
+                lambda: dataset[next(batches) % len(dataset)],
+                max(args.repeats // BATCH_SIZE, 1),
+                BATCH_SIZE,
+            )
+
+        model_path = root / "model.h5"
+        make_model(model_path)
+        os.environ["MODEL_PATH"] = str(model_path)
+        from seldon.seldon_model import SeldonModel
+
+        seldon_model = SeldonModel()
+        requests = iter(range(sys.maxsize))
+
+        def predict() -> None:
+            seldon_model.predict(payloads[next(requests) % len(payloads)], [])
+
+        results["seldon_predict"] = measure(predict, args.repeats)
+        if args.concurrency > 1:
+            seldon_model.batcher = MicroBatcher(
+                seldon_model._forward, args.max_batch_size, args.max_batch_wait_ms
+            )
+            results["seldon_predict_concurrent"] = measure_concurrent(
+                predict, args.repeats, args.concurrency
+            )
+
+    return {
+        "meta": _meta(args),
+        "results": results,
+    }
+
+
+def compare(
+    current: Dict[str, Any], baseline: Dict[str, Any], max_regression: float
+) -> List[str]:
+    """Names of benchmarks whose throughput dropped by more than `max_regression`."""
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        ratio = result["throughput_per_s"] / base["throughput_per_s"]
+        print(f"{name}: {ratio:.2f}x baseline throughput")
+        if ratio < 1 - max_regression:
+            regressions.append(name)
+    return regressions
+
+
+def _meta(args: argparse.Namespace) -> Dict[str, Any]:
+    try:
+        commit: Optional[str] = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "args": {
+            k: v for k, v in vars(args).items() if not isinstance(v, pathlib.Path)
+        },
+    }
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline hot path benchmarks")
+    parser.add_argument(
+        "-o", "--output", type=pathlib.Path, help="Path to write JSON results to"
+    )
+    parser.add_argument(
+        "--baseline", type=pathlib.Path, help="Previous results to compare with"
+    )
+    parser.add_argument(
+        "--max_regression",
+        default=0.1,
+        type=float,
+        help="Allowed relative throughput drop against the baseline",
+    )
+    parser.add_argument("--images", default=64, type=int, help="Synthetic images count")
+    parser.add_argument(
+        "--image_size",
+        default=[500, 375],
+        type=int,
+        nargs=2,
+        help="Synthetic images width and height",
+    )
+    parser.add_argument(
+        "--tasks", default=100000, type=int, help="Tasks in the synthetic export"
+    )
+    parser.add_argument("--repeats", default=200, type=int, help="Calls per benchmark")
+    parser.add_argument(
+        "--concurrency",
+        default=8,
+        type=int,
+        help="Concurrent clients of the serving benchmark, 1 to skip it",
+    )
+    parser.add_argument(
+        "--max_batch_size",
+        default=16,
+        type=int,
+        help="Micro-batch size of the concurrent serving benchmark",
+    )
+    parser.add_argument(
+        "--max_batch_wait_ms",
+        default=5,
+        type=float,
+        help="Micro-batch wait time of the concurrent serving benchmark",
+    )
+    parser.add_argument("--seed", default=0, type=int)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    report = run(args)
+    report_json = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(report_json)
+    else:
+        print(report_json)
+    if args.baseline:
+        regressions = compare(
+            report, json.loads(args.baseline.read_text()), args.max_regression
+        )
+        if regressions:
+            sys.exit(f"Throughput regressions: {', '.join(regressions)}")
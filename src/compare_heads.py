@@ -0,0 +1,165 @@
+"""
+Compare the classifier heads of `src.model.HEADS` on the validation split.
+
+    python src/compare_heads.py -d data/Images -f data/result.json \
+        --features_cache cache/features -o heads.json
+
+Every head is fitted on the cached encoder outputs, which are extracted once
+for all of them. The report lists the validation accuracy, parameter count,
+`.h5` artifact size, load time and CPU latency of the full model per head,
+and recommends the smallest artifact meeting the accuracy bar.
+"""
+import argparse
+import json
+import pathlib
+import random as rn
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import tensorflow as tf
+from keras import models
+from sklearn.model_selection import train_test_split
+
+from config.model import CLASS_ENCODING, EPOCHS, RD_SEED, SPLIT_SEED, TEST_SIZE
+from config.preprocessing import INPUT_SIZE
+from src.dataset import image_path
+from src.features import FeatureCache, FeaturesDataset
+from src.model import HEADS, get_encoder, get_head, get_model
+from src.preprocessing import split_json
+
+
+# Accuracy a head may lose against the best one when no bar is given
+ACCURACY_TOLERANCE = 0.01
+
+
+def compare(args: argparse.Namespace) -> Dict:
+    images, labels = split_json(args.data_description)
+    # the same split as in training
+    X_train, X_test, Y_train, Y_test = train_test_split(
+        images, labels, test_size=TEST_SIZE, stratify=labels, random_state=SPLIT_SEED
+    )
+    results = {}
+    cache = train_rows = test_rows = None
+    for head in args.heads:
+        np.random.seed(RD_SEED)
+        tf.random.set_seed(RD_SEED)
+        rn.seed(RD_SEED)
+        model = get_model(head=head)
+        if cache is None:
+            # every head shares the frozen encoder, hence its cached features
+            cache = FeatureCache(args.features_cache, get_encoder(model))
+            train_rows = cache.rows([image_path(args.data_dir, x) for x in X_train])
+            test_rows = cache.rows([image_path(args.data_dir, x) for x in X_test])
+        features = cache.features
+        head_model = get_head(model)
+        head_model.fit(
+            FeaturesDataset(features, train_rows, Y_train, CLASS_ENCODING),
+            epochs=args.epochs,
+            verbose=2,
+        )
+        _, accuracy = head_model.evaluate(
+            FeaturesDataset(features, test_rows, Y_test, CLASS_ENCODING), verbose=0
+        )
+        results[head] = {
+            "val_acc": float(accuracy),
+            "head_params": int(head_model.count_params()),
+            "total_params": int(model.count_params()),
+            **_measure(model, args.repeats),
+        }
+        print(f"{head}: {json.dumps(results[head])}")
+
+    min_accuracy = args.min_accuracy
+    if min_accuracy is None:
+        best = max(result["val_acc"] for result in results.values())
+        min_accuracy = best - ACCURACY_TOLERANCE
+    passing = [
+        head for head, result in results.items() if result["val_acc"] >= min_accuracy
+    ]
+    recommended = min(
+        passing, key=lambda head: results[head]["artifact_bytes"], default=None
+    )
+    return {
+        "min_accuracy": min_accuracy,
+        "recommended": recommended,
+        "heads": results,
+    }
+
+
+def _measure(model: models.Model, repeats: int) -> Dict:
+    """Artifact size, load time and median single image latency of `model`."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = pathlib.Path(tmp_dir) / "model.h5"
+        model.save(str(path))
+        size = path.stat().st_size
+        started = time.perf_counter()
+        models.load_model(str(path))
+        load_s = time.perf_counter() - started
+
+    x = np.zeros((1, *INPUT_SIZE, 3), dtype=np.float32)
+    model.predict_on_batch(x)
+    latencies = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        model.predict_on_batch(x)
+        latencies.append(time.perf_counter() - started)
+    return {
+        "artifact_bytes": size,
+        "load_s": load_s,
+        "latency_ms": float(np.median(latencies)) * 1000,
+    }
+
+
+def get_args(provided_args: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare the classifier heads on the validation split"
+    )
+    parser.add_argument(
+        "-d", "--data_dir", required=True, type=pathlib.Path, help="Path to the dataset"
+    )
+    parser.add_argument(
+        "-f",
+        "--data_description",
+        required=True,
+        type=pathlib.Path,
+        help="Path to the dataset description file",
+    )
+    parser.add_argument(
+        "--features_cache",
+        required=True,
+        type=pathlib.Path,
+        help="Folder caching the encoder outputs, shared with training",
+    )
+    parser.add_argument(
+        "-o", "--output", type=pathlib.Path, help="Path to write the JSON report to"
+    )
+    parser.add_argument(
+        "--heads",
+        default=sorted(HEADS),
+        nargs="+",
+        choices=sorted(HEADS),
+        help="Heads to compare, all by default",
+    )
+    parser.add_argument("--epochs", default=EPOCHS, type=int)
+    parser.add_argument(
+        "--repeats", default=20, type=int, help="Model calls per latency measure"
+    )
+    parser.add_argument(
+        "--min_accuracy",
+        type=float,
+        help="Validation accuracy bar, the best accuracy less "
+        f"{ACCURACY_TOLERANCE} by default",
+    )
+    return parser.parse_args(provided_args)
+
+
+if __name__ == "__main__":
+    args = get_args()
+    report = compare(args)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    print(
+        f"Smallest head above {report['min_accuracy']:.3f} accuracy: "
+        f"{report['recommended']}"
+    )
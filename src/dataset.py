@@ -2,8 +2,9 @@ import logging
 from pathlib import Path
 import math
 from src.preprocessing import img_to_numpy
-from typing import List, Mapping
-from random import shuffle
+from src.image_cache import ImageShardCache
+from typing import List, Mapping, Optional
+from random import Random
 from keras.utils import Sequence
 from urllib.parse import urlparse
 from config.preprocessing import INPUT_SIZE
@@ -13,6 +14,15 @@ import numpy as np
 from keras.applications.vgg16 import preprocess_input
 
 
+logger = logging.getLogger(__name__)
+
+
+def image_path(dataset_path: Path, image_url: str) -> Path:
+    img_url = URL(image_url)
+    img_name = Path(img_url.query.get('d') or img_url.path).name
+    return dataset_path / img_name
+
+
 class DogsDataset(Sequence):
     def __init__(
         self,
@@ -21,6 +31,8 @@ class DogsDataset(Sequence):
         labels: List[str],
         class_encoding: Mapping[str, int],
         batch_size=BATCH_SIZE,
+        image_cache: Optional[ImageShardCache] = None,
+        seed: Optional[int] = None,
     ) -> None:
         super().__init__()
         assert len(images) == len(labels)
@@ -30,34 +42,80 @@ class DogsDataset(Sequence):
         self.class_encoding = class_encoding
         self.sample_count = len(self.images)
         self.indices = list(range(self.sample_count))
-        shuffle(self.indices)
+        self.seed = seed
+        self.random = Random(seed)
+        self.random.shuffle(self.indices)
         self.batch_size = batch_size
+        self.image_cache = image_cache
 
     def on_epoch_end(self, epoch=None, logs=None) -> None:
-        shuffle(self.indices)
+        self.random.shuffle(self.indices)
+        if self.image_cache is not None:
+            self.image_cache.flush()
+
+    def shard(
+        self, index: int, count: int, batch_size: Optional[int] = None
+    ) -> "DogsDataset":
+        """Dataset of every `count`-th sample starting from `index`."""
+        return DogsDataset(
+            self.dataset_path,
+            self.images[index::count],
+            self.labels[index::count],
+            self.class_encoding,
+            batch_size=batch_size or self.batch_size,
+            image_cache=self.image_cache,
+            seed=self.seed,
+        )
 
     def __str__(self) -> str:
-        return f"DogsDataset\n===== images={self.images}\n===== labels={self.labels}\n===== class enc={self.class_encoding}"
+        return (
+            f"DogsDataset of {self.sample_count} images in {len(self)} batches, "
+            f"class enc={self.class_encoding}"
+        )
 
     def __len__(self) -> int:
         return math.ceil(len(self.images) / self.batch_size)
 
+    def epoch_batches(self) -> List[List[int]]:
+        """Sample indices of every batch of the current epoch, in order."""
+        return [
+            self.indices[i * self.batch_size : (i + 1) * self.batch_size]
+            for i in range(len(self))
+        ]
+
     def __getitem__(self, i: int):
         batch_indices = self.indices[i * self.batch_size : (i + 1) * self.batch_size]
+        return self.load_batch(batch_indices)
+
+    def load_batch(self, batch_indices: List[int]):
+        img_paths = [
+            image_path(self.dataset_path, self.images[bi]) for bi in batch_indices
+        ]
 
-        images = []
-        labels = []
+        images = np.empty((len(batch_indices), *INPUT_SIZE, 3), dtype=np.float32)
+        labels = [self.class_encoding[self.labels[bi]] for bi in batch_indices]
 
-        for bi in batch_indices:
-            img_url = URL(self.images[bi])
-            img_name = Path(img_url.query.get('d') or img_url.path).name
-            img_path = self.dataset_path / img_name
-            print(f'img_name={img_name} img_path={img_path} url={self.images[bi]}')
-            print(f'labels[bi]={self.labels[bi]}')
-            x = img_to_numpy(img_path, target_size=INPUT_SIZE)
-            x = preprocess_input(x)
-            images.append(x)
+        slots = [None] * len(img_paths)
+        if self.image_cache is not None:
+            slots = self.image_cache.lookup(img_paths)
+            hits = [pos for pos, slot in enumerate(slots) if slot is not None]
+            if hits:
+                cached = np.empty((len(hits), *INPUT_SIZE, 3), dtype=np.uint8)
+                self.image_cache.read([slots[pos] for pos in hits], cached)
+                images[hits] = cached
 
-            labels.append(self.class_encoding[self.labels[bi]])
+        for pos, (bi, img_path) in enumerate(zip(batch_indices, img_paths)):
+            if slots[pos] is not None:
+                continue
+            # lazily formatted, this runs for every decoded image
+            logger.debug(
+                "img_path=%s url=%s label=%s",
+                img_path,
+                self.images[bi],
+                self.labels[bi],
+            )
+            images[pos] = img_to_numpy(img_path, target_size=INPUT_SIZE)
+            if self.image_cache is not None:
+                self.image_cache.put(img_path, images[pos])
 
-        return (np.array(images), np.array(labels))
+        return (preprocess_input(images), np.array(labels))
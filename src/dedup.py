@@ -0,0 +1,157 @@
+"""
+Perceptual hashes of images and a near-duplicate index over them.
+
+    python src/dedup.py -d data/Images -o duplicates.json
+
+The difference hash (dHash) of an image compares the brightness of neighbouring
+pixels of its 9x8 grayscale thumbnail. Resized, recompressed or slightly edited
+copies of an image get hashes a few of the 64 bits apart.
+"""
+import argparse
+import json
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from config.preprocessing import DEDUP_MAX_DISTANCE
+
+
+HASH_SIZE = 8
+# Bytes of a hash, searched separately: hashes less than BANDS bits apart
+# are equal in at least one of them
+BANDS = 8
+# Distances computed at once while clustering, bounds the memory use
+BLOCK_SIZE = 1024 ** 2
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def dhash(path: Union[str, pathlib.Path]) -> int:
+    with Image.open(path) as img:
+        # JPEGs are decoded in grayscale at a reduced scale
+        img.draft("L", (HASH_SIZE * 4, HASH_SIZE * 4))
+        thumbnail = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hash_images(
+    paths: Sequence[Union[str, pathlib.Path]], workers: int = 8
+) -> Iterator[int]:
+    """Hash images in threads, PIL releases the GIL while decoding."""
+    with ThreadPoolExecutor(workers) as executor:
+        yield from executor.map(dhash, paths)
+
+
+def hamming(hashes: np.ndarray, other: Union[int, np.ndarray]) -> np.ndarray:
+    """Bit distances between hashes, broadcast like `hashes ^ other`."""
+    x = np.ascontiguousarray(np.bitwise_xor(hashes, np.asarray(other, np.uint64)))
+    return _POPCOUNT[x.view(np.uint8)].reshape(*x.shape, 8).sum(axis=-1)
+
+
+class DuplicateIndex:
+    """
+    Images by their dHash, searched for near duplicates at most
+    `max_distance` bits apart.
+
+    Looking up one hash compares it to all others at once. Clustering only
+    compares hashes sharing a band, which finds every pair as long as
+    `max_distance` is below BANDS.
+    """
+
+    def __init__(self, max_distance: int = DEDUP_MAX_DISTANCE) -> None:
+        if not 0 <= max_distance < BANDS:
+            raise ValueError(f"max_distance must be in [0, {BANDS})")
+        self.max_distance = max_distance
+        self.keys: List[str] = []
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._pending: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def hashes(self) -> np.ndarray:
+        if self._pending:
+            pending = np.array(self._pending, dtype=np.uint64)
+            self._hashes = np.concatenate([self._hashes, pending])
+            self._pending = []
+        return self._hashes
+
+    def add(self, key: str, value: int) -> None:
+        self.keys.append(key)
+        self._pending.append(value)
+
+    def near(self, value: int) -> List[str]:
+        """Keys of the images at most `max_distance` bits away from `value`."""
+        matches = np.flatnonzero(hamming(self.hashes, value) <= self.max_distance)
+        return [self.keys[i] for i in matches]
+
+    def pairs(self) -> Iterator[Tuple[int, int]]:
+        """Positions of near-duplicate pairs, a pair may come up more than once."""
+        hashes = self.hashes
+        bands = hashes.view(np.uint8).reshape(len(hashes), BANDS)
+        for band in range(BANDS):
+            order = np.argsort(bands[:, band], kind="stable")
+            boundaries = np.flatnonzero(np.diff(bands[order, band])) + 1
+            for group in np.split(order, boundaries):
+                rows = max(BLOCK_SIZE // len(group), 1)
+                for start in range(0, len(group) - 1, rows):
+                    left = group[start : start + rows]
+                    distances = hamming(hashes[left, np.newaxis], hashes[group])
+                    i, j = np.nonzero(distances <= self.max_distance)
+                    upper = j > start + i
+                    yield from zip(left[i[upper]].tolist(), group[j[upper]].tolist())
+
+    def clusters(self) -> List[List[str]]:
+        """Groups of two or more images connected by near-duplicate pairs."""
+        parent = list(range(len(self)))
+
+        def root(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, j in self.pairs():
+            parent[root(i)] = root(j)
+        groups: Dict[int, List[str]] = {}
+        for i, key in enumerate(self.keys):
+            groups.setdefault(root(i), []).append(key)
+        return [group for group in groups.values() if len(group) > 1]
+
+
+def get_args(provided_args: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Find clusters of near-duplicate images in a folder"
+    )
+    parser.add_argument(
+        "-d", "--data_dir", required=True, type=pathlib.Path, help="Path to the images"
+    )
+    parser.add_argument(
+        "-o", "--output", type=pathlib.Path, help="Path to write the clusters to"
+    )
+    parser.add_argument(
+        "--max_distance",
+        default=DEDUP_MAX_DISTANCE,
+        type=int,
+        help="Bits between the hashes of near duplicates",
+    )
+    parser.add_argument("-w", "--workers", default=8, type=int)
+    return parser.parse_args(provided_args)
+
+
+if __name__ == "__main__":
+    args = get_args()
+    paths = sorted(path for path in args.data_dir.rglob("*") if path.is_file())
+    index = DuplicateIndex(args.max_distance)
+    for path, value in zip(paths, hash_images(paths, args.workers)):
+        index.add(str(path.relative_to(args.data_dir)), value)
+    clusters = index.clusters()
+    if args.output:
+        args.output.write_text(json.dumps(clusters, indent=2))
+    duplicates = sum(len(cluster) - 1 for cluster in clusters)
+    print(f"{duplicates} of {len(index)} images are near duplicates")
@@ -0,0 +1,82 @@
+"""
+Data-parallel training over the workers described by the `TF_CONFIG` variable.
+
+Every worker runs the same script, `src/launch_workers.py` starts several of
+them on one machine.
+"""
+import json
+import os
+from typing import Dict
+
+import tensorflow as tf
+
+from config.preprocessing import INPUT_SIZE
+from src.dataset import DogsDataset
+
+
+def tf_config() -> Dict:
+    return json.loads(os.environ.get("TF_CONFIG") or "{}")
+
+
+def num_workers() -> int:
+    cluster = tf_config().get("cluster", {})
+    return len(cluster.get("chief", [])) + len(cluster.get("worker", [])) or 1
+
+
+def worker_index() -> int:
+    """Position of this worker among all of them, the chief being the first one."""
+    config = tf_config()
+    task = config.get("task", {})
+    if task.get("type") == "chief":
+        return 0
+    return len(config.get("cluster", {}).get("chief", [])) + task.get("index", 0)
+
+
+def is_chief() -> bool:
+    return worker_index() == 0
+
+
+def get_strategy() -> tf.distribute.Strategy:
+    """
+    Create the strategy. It has to be created before any other TF operation,
+    because it configures the collective ops of the worker.
+    """
+    if "TF_CONFIG" not in os.environ:
+        raise ValueError("TF_CONFIG is not set, see src/launch_workers.py")
+    return tf.distribute.experimental.MultiWorkerMirroredStrategy()
+
+
+def distribute(
+    strategy: tf.distribute.Strategy, dataset: DogsDataset, global_batch_size: int
+) -> tf.distribute.DistributedDataset:
+    """
+    Feed every worker from its own disjoint shard of `dataset`, so the images
+    of one batch are loaded in parallel across workers.
+    """
+
+    def dataset_fn(input_context: tf.distribute.InputContext) -> tf.data.Dataset:
+        shard = dataset.shard(
+            input_context.input_pipeline_id,
+            input_context.num_input_pipelines,
+            batch_size=input_context.get_per_replica_batch_size(global_batch_size),
+        )
+        return to_tf_dataset(shard)
+
+    return strategy.experimental_distribute_datasets_from_function(dataset_fn)
+
+
+def to_tf_dataset(dataset: DogsDataset) -> tf.data.Dataset:
+    """Endless `tf.data` view of a dataset, reshuffled after every pass."""
+
+    def batches():
+        while True:
+            for i in range(len(dataset)):
+                yield dataset[i]
+            dataset.on_epoch_end()
+
+    tf_dataset = tf.data.Dataset.from_generator(
+        batches,
+        output_types=(tf.float32, tf.int64),
+        output_shapes=((None, *INPUT_SIZE, 3), (None,)),
+    )
+    return tf_dataset.prefetch(tf.data.experimental.AUTOTUNE)
@@ -0,0 +1,149 @@
+"""
+SHAP explanations of the predictions, served by `SeldonModel.explain`.
+
+    python src/explain.py -d data/Images -f data/result.json -o background.npy
+
+writes the background set of training images. Masked image regions are
+replaced by its mean image. Serving needs shap only with explanations enabled,
+it is installed by building the Seldon image with `--build-arg EXPLAIN=1`.
+"""
+import argparse
+import pathlib
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from config.model import ENCODING_CLASS, SPLIT_SEED, TEST_SIZE
+from config.preprocessing import INPUT_SIZE
+from src.preprocessing import imgs_to_numpy, preprocess_input
+
+
+# Explanations below this number of evaluations are too coarse to be useful,
+# the time budget has to afford as many at the cost measured on load
+MIN_EVALS = 50
+
+
+class ImageExplainer:
+    """
+    Partition SHAP explainer over image regions, built once per model.
+
+    Masked images are evaluated by the model in batches of `batch_size`.
+    An explanation runs the smaller of `max_evals` and the number of
+    evaluations fitting `time_budget_ms` at the measured cost of one, which
+    may go below MIN_EVALS while evaluations are slower than on load.
+    Raises ValueError when the budget does not afford MIN_EVALS on load.
+    """
+
+    def __init__(
+        self,
+        model: Callable[[np.ndarray], np.ndarray],
+        background: np.ndarray,
+        max_evals: int,
+        batch_size: int,
+        time_budget_ms: float,
+    ) -> None:
+        import shap
+
+        self.model = model
+        self.max_evals = max_evals
+        self.batch_size = batch_size
+        self.time_budget_ms = time_budget_ms
+        masker = shap.maskers.Image(background.mean(axis=0).astype(np.float32))
+        self.explainer = shap.Explainer(
+            self._evaluate,
+            masker,
+            output_names=[ENCODING_CLASS[i] for i in sorted(ENCODING_CLASS)],
+        )
+        started = time.perf_counter()
+        self._evaluate(np.zeros((batch_size, *background.shape[1:]), dtype=np.float32))
+        self.eval_ms = (time.perf_counter() - started) * 1000 / batch_size
+        if self.evals < MIN_EVALS:
+            raise ValueError(
+                f"A time budget of {time_budget_ms:.0f}ms affords {self.evals} "
+                f"evaluations at {self.eval_ms:.1f}ms each, explanations need "
+                f"at least {MIN_EVALS}"
+            )
+
+    @property
+    def evals(self) -> int:
+        if not self.time_budget_ms:
+            return self.max_evals
+        affordable = int(self.time_budget_ms / self.eval_ms)
+        # the budget wins over MIN_EVALS, shap runs at least one evaluation
+        return max(min(self.max_evals, affordable), 1)
+
+    def __call__(self, image: np.ndarray, output: int) -> np.ndarray:
+        """Attribution of every pixel of `image` to the `output` class score."""
+        max_evals = self.evals
+        started = time.perf_counter()
+        explanation = self.explainer(
+            image[np.newaxis],
+            max_evals=max_evals,
+            batch_size=self.batch_size,
+            outputs=np.array([output]),
+            silent=True,
+        )
+        # follow the evaluation cost, it changes with the load of the replica
+        eval_ms = (time.perf_counter() - started) * 1000 / max_evals
+        self.eval_ms = 0.8 * self.eval_ms + 0.2 * eval_ms
+        return explanation.values[0, ..., 0].sum(axis=-1)
+
+    def _evaluate(self, x: np.ndarray) -> np.ndarray:
+        return np.asarray(self.model(preprocess_input(x.astype(np.float32))))
+
+
+def make_background(args: argparse.Namespace) -> np.ndarray:
+    from sklearn.model_selection import train_test_split
+
+    from src.dataset import image_path
+    from src.preprocessing import split_json
+
+    images, labels = split_json(args.data_description)
+    # training images only, stratified by class
+    X_train, _, Y_train, _ = train_test_split(
+        images, labels, test_size=TEST_SIZE, stratify=labels, random_state=SPLIT_SEED
+    )
+    samples = min(args.samples, len(X_train))
+    if samples < len(X_train):
+        X_train, _ = train_test_split(
+            X_train, train_size=samples, stratify=Y_train, random_state=args.seed
+        )
+    paths = [image_path(args.data_dir, x) for x in X_train]
+    return imgs_to_numpy(paths, target_size=INPUT_SIZE).astype(np.uint8)
+
+
+def get_args(provided_args: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Write the background set of the SHAP explainer"
+    )
+    parser.add_argument(
+        "-d", "--data_dir", required=True, type=pathlib.Path, help="Path to the dataset"
+    )
+    parser.add_argument(
+        "-f",
+        "--data_description",
+        required=True,
+        type=pathlib.Path,
+        help="Path to the dataset description file",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        required=True,
+        type=pathlib.Path,
+        help="Path to the .npy file to write, serving looks for background.npy "
+        "next to the model",
+    )
+    parser.add_argument(
+        "-n", "--samples", default=50, type=int, help="Number of background images"
+    )
+    parser.add_argument("--seed", default=SPLIT_SEED, type=int)
+    return parser.parse_args(provided_args)
+
+
+if __name__ == "__main__":
+    args = get_args()
+    background = make_background(args)
+    np.save(args.output, background)
+    print(f"Saved {len(background)} background images to {args.output}")
@@ -0,0 +1,133 @@
+import argparse
+import json
+import pathlib
+import time
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import tensorflow as tf
+from sklearn.model_selection import train_test_split
+
+from config.model import BATCH_SIZE, CLASS_ENCODING, SPLIT_SEED, TEST_SIZE
+from config.preprocessing import INPUT_SIZE
+from src.dataset import image_path
+from src.inference import TFLiteBackend
+from src.preprocessing import imgs_to_numpy, preprocess_input, split_json
+
+
+QUANTIZATION_MODES = ("none", "dynamic", "int8")
+
+
+def export(args: argparse.Namespace) -> Dict:
+    model = tf.keras.models.load_model(args.model)
+    images, labels = split_json(args.data_description)
+    X_train, X_test, Y_train, Y_test = train_test_split(
+        images, labels, test_size=TEST_SIZE, stratify=labels, random_state=SPLIT_SEED
+    )
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if args.quantization != "none":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if args.quantization == "int8":
+        calibration_paths = [
+            image_path(args.data_dir, x) for x in X_train[: args.calibration_samples]
+        ]
+        converter.representative_dataset = lambda: _calibration_data(calibration_paths)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    args.output.write_bytes(converter.convert())
+    print(f"Saved {args.quantization} quantized model to {args.output}")
+
+    tflite_model = TFLiteBackend(args.output)
+    test_paths = [image_path(args.data_dir, x) for x in X_test]
+    y_true = np.array([CLASS_ENCODING[y] for y in Y_test])
+    keras_eval = _evaluate(lambda x: model(x).numpy(), test_paths, y_true)
+    tflite_eval = _evaluate(tflite_model, test_paths, y_true)
+    agreement = np.mean(keras_eval.pop("predictions") == tflite_eval.pop("predictions"))
+
+    return {
+        "quantization": args.quantization,
+        "validation_samples": len(test_paths),
+        "keras": keras_eval,
+        "tflite": tflite_eval,
+        "accuracy_diff": tflite_eval["accuracy"] - keras_eval["accuracy"],
+        "prediction_agreement": float(agreement),
+        "keras_model_bytes": args.model.stat().st_size,
+        "tflite_model_bytes": args.output.stat().st_size,
+    }
+
+
+def _calibration_data(paths: List[pathlib.Path]) -> Iterator[List[np.ndarray]]:
+    for path in paths:
+        x = imgs_to_numpy([path], target_size=INPUT_SIZE)
+        yield [preprocess_input(x)]
+
+
+def _evaluate(model, paths: List[pathlib.Path], y_true: np.ndarray) -> Dict:
+    predictions = []
+    inference_time = 0.0
+    for start in range(0, len(paths), BATCH_SIZE):
+        x = imgs_to_numpy(paths[start : start + BATCH_SIZE], target_size=INPUT_SIZE)
+        x = preprocess_input(x)
+        started = time.perf_counter()
+        scores = model(x)
+        inference_time += time.perf_counter() - started
+        predictions.append(np.argmax(scores, axis=-1))
+    y_pred = np.concatenate(predictions)
+    return {
+        "accuracy": float(np.mean(y_pred == y_true)),
+        "ms_per_image": inference_time / len(paths) * 1000,
+        "predictions": y_pred,
+    }
+
+
+def get_args(provided_args: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Export the trained model to TFLite and compare it on the "
+        "validation split"
+    )
+    parser.add_argument(
+        "-m", "--model", required=True, type=pathlib.Path, help="Path to the .h5 model"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        required=True,
+        type=pathlib.Path,
+        help="Path to the .tflite model to write",
+    )
+    parser.add_argument(
+        "-q",
+        "--quantization",
+        default="dynamic",
+        choices=QUANTIZATION_MODES,
+        help="Post-training quantization: none, dynamic range or full int8 "
+        "calibrated on training images",
+    )
+    parser.add_argument(
+        "--calibration_samples",
+        default=200,
+        type=int,
+        help="Number of training images to calibrate int8 quantization on",
+    )
+    parser.add_argument(
+        "-d", "--data_dir", required=True, type=pathlib.Path, help="Path to the dataset"
+    )
+    parser.add_argument(
+        "-f",
+        "--data_description",
+        required=True,
+        type=pathlib.Path,
+        help="Path to the dataset description file",
+    )
+    parser.add_argument(
+        "-r", "--report", type=pathlib.Path, help="Path to write the JSON report to"
+    )
+    return parser.parse_args(provided_args)
+
+
+if __name__ == "__main__":
+    args = get_args()
+    report = json.dumps(export(args), indent=2)
+    print(report)
+    if args.report:
+        args.report.write_text(report)
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import math
+import os
+from pathlib import Path
+from random import shuffle
+from typing import Dict, List, Mapping, Optional, Sequence as SequenceT
+
+import numpy as np
+from keras import models
+from keras.applications.vgg16 import preprocess_input
+from keras.utils import Sequence
+
+from config.model import BATCH_SIZE, INPUT_LAYER_SHAPE
+from config.preprocessing import INPUT_SIZE
+from src.fingerprint import file_hash
+from src.preprocessing import imgs_to_numpy, preprocessing_key
+
+
+logger = logging.getLogger(__name__)
+
+FEATURE_BYTES = int(np.prod(INPUT_LAYER_SHAPE)) * np.dtype(np.float32).itemsize
+
+
+def weights_hash(model: models.Model) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for weights in model.get_weights():
+        digest.update(np.ascontiguousarray(weights).tobytes())
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    """
+    On-disk cache of encoder outputs keyed by image content hash.
+
+    Features of all images are appended to a single float32 file, which is
+    memory-mapped for reading; `index.json` maps an image hash to its row.
+    The cache lives in a sub-folder named after the encoder weights hash and
+    the image decoding, so it is reused across retrains only while both stay
+    the same.
+    """
+
+    def __init__(self, root: Path, encoder: models.Model) -> None:
+        self.encoder = encoder
+        self.path = Path(root) / f"{weights_hash(encoder)}-{preprocessing_key()}"
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._index_path = self.path / "index.json"
+        self._data_path = self.path / "features.f32"
+        self.index: Dict[str, int] = {}
+        if self._index_path.exists():
+            self.index = json.loads(self._index_path.read_text())
+
+    def __len__(self) -> int:
+        if not self._data_path.exists():
+            return 0
+        # rows written after the last index save are left unreferenced
+        return self._data_path.stat().st_size // FEATURE_BYTES
+
+    @property
+    def features(self) -> np.memmap:
+        return np.memmap(
+            self._data_path,
+            dtype=np.float32,
+            mode="r",
+            shape=(len(self), *INPUT_LAYER_SHAPE),
+        )
+
+    def rows(
+        self,
+        paths: SequenceT[Path],
+        batch_size: int = BATCH_SIZE,
+        hashes: Optional[SequenceT[str]] = None,
+    ) -> np.ndarray:
+        """
+        Return the cache rows holding features of `paths`, running the encoder
+        for images which are not cached yet. Known content `hashes` of the
+        images save reading them.
+        """
+        if hashes is None:
+            hashes = [file_hash(path) for path in paths]
+        missing: Dict[str, Path] = {}
+        for path, digest in zip(paths, hashes):
+            if digest not in self.index and digest not in missing:
+                missing[digest] = path
+
+        if missing:
+            logger.info("Extracting features of %d images", len(missing))
+            self._extract(missing, batch_size)
+
+        return np.array([self.index[digest] for digest in hashes], dtype=np.int64)
+
+    def _extract(self, missing: Mapping[str, Path], batch_size: int) -> None:
+        items = list(missing.items())
+        with self._data_path.open("ab") as fd:
+            for start in range(0, len(items), batch_size):
+                batch = items[start : start + batch_size]
+                x = imgs_to_numpy([path for _, path in batch], target_size=INPUT_SIZE)
+                features = self.encoder.predict_on_batch(preprocess_input(x))
+                row = len(self)
+                fd.write(np.asarray(features, dtype=np.float32).tobytes())
+                fd.flush()
+                for offset, (digest, _) in enumerate(batch):
+                    self.index[digest] = row + offset
+        self._save_index()
+
+    def _save_index(self) -> None:
+        tmp_path = self._index_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.index))
+        os.replace(tmp_path, self._index_path)
+
+
+class FeaturesDataset(Sequence):
+    def __init__(
+        self,
+        features: np.ndarray,
+        rows: np.ndarray,
+        labels: List[str],
+        class_encoding: Mapping[str, int],
+        batch_size: int = BATCH_SIZE,
+    ) -> None:
+        super().__init__()
+        assert len(rows) == len(labels)
+        self.features = features
+        self.rows = rows
+        self.labels = np.array([class_encoding[label] for label in labels])
+        self.indices = list(range(len(rows)))
+        shuffle(self.indices)
+        self.batch_size = batch_size
+
+    def on_epoch_end(self, epoch=None, logs=None) -> None:
+        shuffle(self.indices)
+
+    def __len__(self) -> int:
+        return math.ceil(len(self.rows) / self.batch_size)
+
+    def __getitem__(self, i: int):
+        batch_indices = self.indices[i * self.batch_size : (i + 1) * self.batch_size]
+        return (
+            self.features[self.rows[batch_indices]],
+            self.labels[batch_indices],
+        )
@@ -0,0 +1,87 @@
+"""
+Fingerprint of the training set of a Label Studio export.
+
+    python -m src.fingerprint -f data/result.json --check last_fingerprint.txt
+
+Only the (image, label) pairs training reads are hashed, in their order, so
+exports differing in Label Studio metadata, like timestamps or annotation ids,
+share a fingerprint. Kept free of third-party imports, so it runs in the
+Pachyderm pipeline image.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from src.ls_export import iter_labeled
+
+
+# Bumped when the training set is read differently, to invalidate fingerprints
+FINGERPRINT_VERSION = b"1"
+
+
+def fingerprint(pairs: Iterable[Tuple[str, str]]) -> str:
+    digest = hashlib.sha256(FINGERPRINT_VERSION)
+    for image, label in pairs:
+        # one JSON list per pair, so no two sequences of pairs hash alike
+        digest.update(json.dumps([image, label]).encode() + b"\n")
+    return digest.hexdigest()
+
+
+def file_hash(path: Path) -> str:
+    """Content hash of a file, keying the caches of image features."""
+    return hashlib.blake2b(Path(path).read_bytes(), digest_size=16).hexdigest()
+
+
+def read_fingerprint(path: Path) -> Optional[str]:
+    try:
+        return path.read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_fingerprint(path: Path, value: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(value + "\n")
+    os.replace(tmp_path, path)
+
+
+def get_args(provided_args: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Fingerprint the training set of a Label Studio export"
+    )
+    parser.add_argument(
+        "-f",
+        "--data_description",
+        required=True,
+        type=Path,
+        help="Path to the dataset description file",
+    )
+    parser.add_argument(
+        "--check",
+        type=Path,
+        help="Fingerprint file of the last trained model, exit with 0 if it "
+        "matches and 1 otherwise",
+    )
+    parser.add_argument(
+        "-o", "--output", type=Path, help="Path to write the fingerprint to"
+    )
+    return parser.parse_args(provided_args)
+
+
+if __name__ == "__main__":
+    args = get_args()
+    value = fingerprint(iter_labeled(args.data_description))
+    print(value)
+    if args.output:
+        write_fingerprint(args.output, value)
+    if args.check:
+        previous = read_fingerprint(args.check)
+        if previous != value:
+            print(f"Training set changed since fingerprint {previous}")
+            sys.exit(1)
+        print("Training set unchanged")
@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config.preprocessing import (
+    IMAGE_CACHE_MAX_BYTES,
+    IMAGE_CACHE_SHARD_SIZE,
+    INPUT_SIZE,
+)
+from src.preprocessing import preprocessing_key
+
+
+logger = logging.getLogger(__name__)
+
+# (shard, offset) of a cached image
+Slot = Tuple[int, int]
+
+
+class ImageShardCache:
+    """
+    Decoded and resized images stored as uint8 in memory-mapped shards.
+
+    Every shard is a file of `shard_size` images of `INPUT_SIZE`; `index.json`
+    maps an image name to its shard, offset and the size and mtime
+    of the source file, so an entry is dropped once the source changes.
+    The shards of a cache built with another image decoding or shard size
+    are deleted on open; a non-empty folder without an index is refused.
+    New images are not cached once `max_bytes` worth of shards is allocated.
+
+    Only the process which opened the cache writes to it, unpickled copies
+    (e.g. in the data loader worker processes) are read-only.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        max_bytes: int = IMAGE_CACHE_MAX_BYTES,
+        shard_size: int = IMAGE_CACHE_SHARD_SIZE,
+    ) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.shard_size = shard_size
+        self.image_shape = (*INPUT_SIZE, 3)
+        self.shard_bytes = shard_size * int(np.prod(self.image_shape))
+        self._index_path = self.root / "index.json"
+        self._lock = threading.Lock()
+        self._shards: Dict[int, np.memmap] = {}
+        self._dirty = False
+        self.readonly = False
+
+        self.entries: Dict[str, List[int]] = {}
+        meta = self._read_meta()
+        preprocessing = self._meta()["preprocessing"]
+        if meta is not None and meta.get("preprocessing") == preprocessing:
+            self.entries = meta["entries"]
+        elif meta is not None:
+            logger.info("Image cache at %s is outdated, wiping it", self.root)
+            self._wipe()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._next_slot = len(self.entries)
+
+    def __getstate__(self) -> Dict:
+        state = self.__dict__.copy()
+        del state["_lock"], state["_shards"]
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._shards = {}
+        self.readonly = True
+
+    def lookup(self, paths: Sequence[Path]) -> List[Optional[Slot]]:
+        """Return slots of up-to-date cached images or None for the misses."""
+        slots: List[Optional[Slot]] = []
+        for path in paths:
+            entry = self.entries.get(path.name)
+            if entry is not None and entry[2:] != _file_version(path):
+                entry = None
+            slots.append(None if entry is None else (entry[0], entry[1]))
+        return slots
+
+    def read(self, slots: Sequence[Slot], out: np.ndarray) -> None:
+        """Copy images at `slots` into `out`, one fancy-indexed read per shard."""
+        shards = np.array([slot[0] for slot in slots])
+        offsets = np.array([slot[1] for slot in slots])
+        for shard in np.unique(shards):
+            positions = np.flatnonzero(shards == shard)
+            out[positions] = self._shard(int(shard))[offsets[positions]]
+
+    def put(self, path: Path, image: np.ndarray) -> None:
+        if self.readonly:
+            return
+        with self._lock:
+            entry = self.entries.get(path.name)
+            if entry is not None:
+                shard, offset = entry[0], entry[1]
+            else:
+                shard, offset = divmod(self._next_slot, self.shard_size)
+                if (shard + 1) * self.shard_bytes > self.max_bytes:
+                    return
+                self._next_slot += 1
+            self._shard(shard)[offset] = image
+            self.entries[path.name] = [shard, offset, *_file_version(path)]
+            self._dirty = True
+
+    def flush(self) -> None:
+        with self._lock:
+            if self.readonly or not self._dirty:
+                return
+            for shard in self._shards.values():
+                shard.flush()
+            meta = {**self._meta(), "entries": self.entries}
+            tmp_path = self._index_path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(meta))
+            os.replace(tmp_path, self._index_path)
+            self._dirty = False
+
+    def _meta(self) -> Dict:
+        return {
+            "input_size": list(INPUT_SIZE),
+            "preprocessing": f"{preprocessing_key()}-shard{self.shard_size}",
+        }
+
+    def _read_meta(self) -> Optional[Dict]:
+        """
+        Index of the cache at `root`, None if there is none yet. A folder
+        holding other files than those of a cache is refused, never wiped.
+        """
+        if not self._index_path.exists():
+            leftovers = self._files()
+            if len(leftovers) < len(list(self.root.glob("*"))):
+                raise ValueError(f"{self.root} is not empty and has no cache index")
+            # shards of a run which stopped before writing the index
+            for path in leftovers:
+                path.unlink()
+            return None
+        try:
+            meta = json.loads(self._index_path.read_text())
+        except ValueError:
+            meta = None
+        if not isinstance(meta, dict) or "entries" not in meta:
+            raise ValueError(f"{self._index_path} is not an image cache index")
+        return meta
+
+    def _files(self) -> List[Path]:
+        return [
+            *self.root.glob("shard-*.u8"),
+            *self.root.glob(self._index_path.with_suffix(".tmp").name),
+        ]
+
+    def _wipe(self) -> None:
+        for path in [*self._files(), self._index_path]:
+            path.unlink()
+
+    def _shard(self, shard: int) -> np.memmap:
+        if shard not in self._shards:
+            shard_path = self.root / f"shard-{shard:05d}.u8"
+            if not shard_path.exists():
+                # sparse file, disk space is taken as images are written
+                with shard_path.open("wb") as fd:
+                    fd.truncate(self.shard_bytes)
+            self._shards[shard] = np.memmap(
+                shard_path,
+                dtype=np.uint8,
+                mode="r" if self.readonly else "r+",
+                shape=(self.shard_size, *self.image_shape),
+            )
+        return self._shards[shard]
+
+
+def _file_version(path: Path) -> List[int]:
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
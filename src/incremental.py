@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import os
+import random as rn
+from collections import Counter
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+from src.fingerprint import file_hash
+
+
+if TYPE_CHECKING:
+    from keras import models
+
+
+logger = logging.getLogger(__name__)
+
+
+def label_drift(old_labels: Iterable[str], new_labels: Iterable[str]) -> float:
+    """Total variation distance between two label distributions."""
+    old_counts = Counter(old_labels)
+    new_counts = Counter(new_labels)
+    old_total = sum(old_counts.values())
+    new_total = sum(new_counts.values())
+    if not old_total or not new_total:
+        return 1.0
+    return (
+        sum(
+            abs(old_counts[label] / old_total - new_counts[label] / new_total)
+            for label in old_counts.keys() | new_counts.keys()
+        )
+        / 2
+    )
+
+
+def hash_split(image: str, test_size: float) -> str:
+    """Stable split of a sample added after the initial train/test split."""
+    digest = hashlib.blake2b(image.encode(), digest_size=8).digest()
+    return "test" if int.from_bytes(digest, "big") / 2 ** 64 < test_size else "train"
+
+
+def fine_tune_images(
+    samples: Dict[str, Dict], changed: Iterable[str], budget: int, seed: int
+) -> Tuple[List[str], List[str]]:
+    """
+    New training images and old ones replayed along, up to `budget` images
+    or as many as the new ones. Nothing is replayed without new training
+    images, e.g. when every changed sample went to the test split.
+    """
+    changed = set(changed)
+    train_images = [x for x, sample in samples.items() if sample["split"] == "train"]
+    new_images = [x for x in train_images if x in changed]
+    if not new_images:
+        return [], []
+    old_images = [x for x in train_images if x not in changed]
+    replay_size = min(len(old_images), max(budget - len(new_images), len(new_images)))
+    return new_images, rn.Random(seed).sample(old_images, replay_size)
+
+
+class TrainState:
+    """
+    Samples and weights of the previous training run.
+
+    `manifest.json` maps every image of the export to its label, content hash,
+    file stat and split, and the head architecture of the model, `model.h5`
+    holds the weights the run ended with.
+    Image hashes are only recomputed for files whose size or mtime changed.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.root / "manifest.json"
+        self.weights_path = self.root / "model.h5"
+        self.previous: Dict[str, Dict] = {}
+        self.head: Optional[str] = None
+        if self.manifest_path.exists() and self.weights_path.exists():
+            manifest = json.loads(self.manifest_path.read_text())
+            self.previous = manifest["samples"]
+            # states saved before the head was configurable
+            self.head = manifest.get("head", "flatten")
+
+    def samples(
+        self, paths: List[Path], images: List[str], labels: List[str]
+    ) -> Dict[str, Dict]:
+        """
+        Describe the samples of the current export, with the files of `images`
+        at `paths`. Samples unchanged since the previous run keep their split,
+        the split of others is None.
+        """
+        samples = {}
+        for path, image, label in zip(paths, images, labels):
+            stat = path.stat()
+            old = self.previous.get(image)
+            if (
+                old is not None
+                and old["size"] == stat.st_size
+                and old["mtime_ns"] == stat.st_mtime_ns
+            ):
+                digest = old["hash"]
+            else:
+                digest = file_hash(path)
+            samples[image] = {
+                "label": label,
+                "hash": digest,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "split": old["split"] if old and old["hash"] == digest else None,
+            }
+        return samples
+
+    def changed(self, samples: Dict[str, Dict]) -> List[str]:
+        """Images which are new or whose content or label changed."""
+        changed = []
+        for image, sample in samples.items():
+            old = self.previous.get(image)
+            if (
+                old is None
+                or old["hash"] != sample["hash"]
+                or old["label"] != sample["label"]
+            ):
+                changed.append(image)
+        return changed
+
+    def drift(self, samples: Dict[str, Dict]) -> float:
+        return label_drift(
+            (sample["label"] for sample in self.previous.values()),
+            (sample["label"] for sample in samples.values()),
+        )
+
+    def save(self, model: "models.Model", samples: Dict[str, Dict], head: str) -> None:
+        # keras picks the weights format by the extension
+        tmp_weights = self.root / "model.tmp.h5"
+        model.save_weights(str(tmp_weights))
+        os.replace(tmp_weights, self.weights_path)
+        tmp_manifest = self.manifest_path.with_suffix(".tmp")
+        tmp_manifest.write_text(json.dumps({"samples": samples, "head": head}))
+        os.replace(tmp_manifest, self.manifest_path)
+        self.previous = samples
+        self.head = head
+        logger.info("Saved the training state of %d samples", len(samples))
@@ -0,0 +1,140 @@
+import pathlib
+import threading
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+
+# TensorFlow is imported only by the backends using it, the tflite backend
+# runs on the standalone tflite_runtime package when it is installed.
+
+# Model file patterns of the inference backends
+BACKEND_MODEL_PATTERNS = {"keras": "*.h5", "tflite": "*.tflite"}
+
+
+class KerasBackend:
+    def __init__(self, model_path: pathlib.Path) -> None:
+        import tensorflow as tf
+
+        self.model = tf.keras.models.load_model(model_path)
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        return self.model(x).numpy()
+
+
+class TFLiteBackend:
+    """
+    Runs a model exported by `src/export_tflite.py`.
+
+    Without `batch_sizes` the input tensor is resized to the batch size of
+    every call. Otherwise there is an interpreter allocated once per batch
+    size: calls are zero-padded up to the smallest size fitting them and
+    calls above the largest size run in chunks of it, so varying batches do
+    not reallocate tensors, at the cost of the memory of an interpreter
+    per size. Quantized inputs and outputs are (de)quantized with the
+    parameters of the model.
+    Uses `tflite_runtime` when it is installed and falls back to `tf.lite`.
+    """
+
+    def __init__(
+        self,
+        model_path: pathlib.Path,
+        num_threads: Optional[int] = None,
+        batch_sizes: Sequence[int] = (),
+    ) -> None:
+        self.model_path = str(model_path)
+        self.num_threads = num_threads
+        self.batch_sizes = sorted(set(batch_sizes))
+        self._interpreter_class = _interpreter_class()
+        self._interpreters: Dict[int, Any] = {}
+        self.interpreter = self._interpreter(
+            self.batch_sizes[0] if self.batch_sizes else None
+        )
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = self._input["shape"][0]
+        # the interpreters are not thread-safe
+        self._lock = threading.Lock()
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        if not self.batch_sizes:
+            with self._lock:
+                if x.shape[0] != self._batch_size:
+                    self.interpreter.resize_tensor_input(self._input["index"], x.shape)
+                    self.interpreter.allocate_tensors()
+                    self._batch_size = x.shape[0]
+                return self._invoke(self.interpreter, x)
+        largest = self.batch_sizes[-1]
+        if len(x) > largest:
+            return np.concatenate(
+                [
+                    self(x[start : start + largest])
+                    for start in range(0, len(x), largest)
+                ]
+            )
+        batch_size = next(size for size in self.batch_sizes if size >= len(x))
+        padded = np.zeros((batch_size, *x.shape[1:]), dtype=x.dtype)
+        padded[: len(x)] = x
+        with self._lock:
+            interpreter = self._interpreter(batch_size)
+            return self._invoke(interpreter, padded)[: len(x)]
+
+    def _interpreter(self, size: Optional[int]) -> Any:
+        """The interpreter of a batch size, None for the one of the model."""
+        if size not in self._interpreters:
+            threads = self.num_threads
+            kwargs = {} if threads is None else {"num_threads": threads}
+            interpreter = self._interpreter_class(model_path=self.model_path, **kwargs)
+            if size is not None:
+                details = interpreter.get_input_details()[0]
+                interpreter.resize_tensor_input(
+                    details["index"], [size, *details["shape"][1:]]
+                )
+            interpreter.allocate_tensors()
+            self._interpreters[size] = interpreter
+        return self._interpreters[size]
+
+    def _invoke(self, interpreter: Any, x: np.ndarray) -> np.ndarray:
+        interpreter.set_tensor(self._input["index"], _quantize(x, self._input))
+        interpreter.invoke()
+        output = interpreter.get_tensor(self._output["index"])
+        return _dequantize(output, self._output)
+
+
+def load_backend(
+    backend: str,
+    model_path: pathlib.Path,
+    num_threads: Optional[int] = None,
+    batch_sizes: Sequence[int] = (),
+):
+    if backend == "keras":
+        return KerasBackend(model_path)
+    if backend == "tflite":
+        return TFLiteBackend(model_path, num_threads, batch_sizes)
+    raise ValueError(f"Unknown inference backend: {backend}")
+
+
+def _interpreter_class() -> type:
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+def _quantize(x: np.ndarray, details: dict) -> np.ndarray:
+    scale, zero_point = details["quantization"]
+    if not scale:
+        return x.astype(details["dtype"])
+    info = np.iinfo(details["dtype"])
+    x = np.round(x / scale + zero_point)
+    return np.clip(x, info.min, info.max).astype(details["dtype"])
+
+
+def _dequantize(x: np.ndarray, details: dict) -> np.ndarray:
+    scale, zero_point = details["quantization"]
+    if not scale:
+        return x.copy()
+    return (x.astype(np.float32) - zero_point) * scale
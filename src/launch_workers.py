@@ -0,0 +1,87 @@
+"""
+Run distributed training with several worker processes on this machine:
+
+    python src/launch_workers.py -n 2 -- -d data/Images -f data/result.json
+
+Arguments after `--` are passed to `src/train.py`.
+"""
+import argparse
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import time
+from typing import List
+
+
+TRAIN_SCRIPT = pathlib.Path(__file__).parent / "train.py"
+
+
+def worker_env(index: int, num_workers: int, base_port: int, threads: int) -> dict:
+    tf_config = {
+        "cluster": {
+            "worker": [f"localhost:{base_port + i}" for i in range(num_workers)]
+        },
+        "task": {"type": "worker", "index": index},
+    }
+    env = dict(os.environ, TF_CONFIG=json.dumps(tf_config))
+    if threads:
+        # split the cores between the workers instead of oversubscribing them
+        env["OMP_NUM_THREADS"] = str(threads)
+        env["TF_NUM_INTRAOP_THREADS"] = str(threads)
+        env["TF_NUM_INTEROP_THREADS"] = "1"
+    return env
+
+
+def launch(args: argparse.Namespace) -> int:
+    threads = args.threads_per_worker
+    if threads is None:
+        threads = max((os.cpu_count() or 1) // args.num_workers, 1)
+    cmd = [sys.executable, "-u", str(TRAIN_SCRIPT), "--distributed", *args.train_args]
+    workers: List[subprocess.Popen] = [
+        subprocess.Popen(
+            cmd, env=worker_env(i, args.num_workers, args.base_port, threads)
+        )
+        for i in range(args.num_workers)
+    ]
+    try:
+        while True:
+            codes = [worker.poll() for worker in workers]
+            failed = [code for code in codes if code not in (None, 0)]
+            if failed:
+                # the other workers would wait for the failed one forever
+                print(f"A worker exited with code {failed[0]}, stopping all of them")
+                return failed[0]
+            if all(code == 0 for code in codes):
+                return 0
+            time.sleep(1)
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+                worker.wait()
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Launch local training workers")
+    parser.add_argument(
+        "-n", "--num_workers", default=2, type=int, help="Number of worker processes"
+    )
+    parser.add_argument(
+        "--base_port",
+        default=23456,
+        type=int,
+        help="Port of the first worker, the others use the following ones",
+    )
+    parser.add_argument(
+        "--threads_per_worker",
+        type=int,
+        help="CPU threads of every worker, cores divided by workers by default",
+    )
+    parser.add_argument("train_args", nargs="*", help="Arguments of src/train.py")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(launch(get_args()))
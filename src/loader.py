@@ -0,0 +1,91 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Deque, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config.model import LOADER_WORKERS, PREFETCH_BATCHES
+from src.dataset import DogsDataset
+
+
+Batch = Tuple[np.ndarray, np.ndarray]
+
+# dataset of a loader worker process
+_worker_dataset: Optional[DogsDataset] = None
+
+
+class PrefetchLoader:
+    """
+    Endless generator of `DogsDataset` batches, loaded on a pool of workers.
+
+    Batches are yielded in the same order as the dataset would return them,
+    at most `prefetch` batches are loaded ahead of the consumer.
+    Batch indices of an epoch are taken before `on_epoch_end` shuffles them,
+    so the per-epoch shuffle stays the same as with a plain `Sequence`.
+
+    Threads are enough for the Pillow decoding, which releases the GIL,
+    processes do not fill the decoded image cache.
+    """
+
+    def __init__(
+        self,
+        dataset: DogsDataset,
+        workers: int = LOADER_WORKERS,
+        prefetch: int = PREFETCH_BATCHES,
+        use_processes: bool = False,
+    ) -> None:
+        self.dataset = dataset
+        self.prefetch = max(prefetch, 1)
+        self._executor: Executor
+        if use_processes:
+            self._executor = ProcessPoolExecutor(
+                workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(dataset,),
+            )
+        else:
+            self._executor = ThreadPoolExecutor(workers)
+        self._use_processes = use_processes
+        self._pending: Deque[Future] = deque()
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __iter__(self) -> Iterator[Batch]:
+        for batch_indices in self._batches():
+            self._pending.append(self._submit(batch_indices))
+            if len(self._pending) >= self.prefetch:
+                yield self._pending.popleft().result()
+
+    def __enter__(self) -> "PrefetchLoader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        while self._pending:
+            self._pending.popleft().cancel()
+        self._executor.shutdown(wait=True)
+
+    def _batches(self) -> Iterator[List[int]]:
+        while True:
+            yield from self.dataset.epoch_batches()
+            self.dataset.on_epoch_end()
+
+    def _submit(self, batch_indices: List[int]) -> Future:
+        if self._use_processes:
+            return self._executor.submit(_load_batch, batch_indices)
+        return self._executor.submit(self.dataset.load_batch, batch_indices)
+
+
+def _init_worker(dataset: DogsDataset) -> None:
+    global _worker_dataset
+    _worker_dataset = dataset
+
+
+def _load_batch(batch_indices: List[int]) -> Batch:
+    assert _worker_dataset is not None
+    return _worker_dataset.load_batch(batch_indices)
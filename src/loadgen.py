@@ -0,0 +1,82 @@
+import math
+import os
+import pathlib
+import random
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from config.model import FNAME_CLASS
+
+
+class Payload(NamedTuple):
+    name: str
+    label: str
+    data: bytes
+
+
+def image_label(name: str) -> Optional[str]:
+    """Breed of a Stanford Dogs image named like `n02085936_1003.jpg`."""
+    return FNAME_CLASS.get(name.split("_")[0])
+
+
+def load_payloads(
+    imgs_dir: pathlib.Path, per_class: int, seed: Optional[int] = None
+) -> List[Payload]:
+    """
+    Read up to `per_class` random images of every class into memory.
+
+    The tree is listed once, images are sampled with a per-class reservoir,
+    so only the sampled files are read.
+    """
+    rng = random.Random(seed)
+    reservoirs: Dict[str, List[pathlib.Path]] = {
+        label: [] for label in FNAME_CLASS.values()
+    }
+    seen = dict.fromkeys(reservoirs, 0)
+    for root, _, files in os.walk(imgs_dir):
+        for name in files:
+            label = image_label(name)
+            if label is None or not name.endswith(".jpg"):
+                continue
+            seen[label] += 1
+            reservoir = reservoirs[label]
+            if len(reservoir) < per_class:
+                reservoir.append(pathlib.Path(root) / name)
+            else:
+                replace = rng.randrange(seen[label])
+                if replace < per_class:
+                    reservoir[replace] = pathlib.Path(root) / name
+    return [
+        Payload(path.name, label, path.read_bytes())
+        for label, paths in reservoirs.items()
+        for path in paths
+    ]
+
+
+def summarize(
+    latencies_s: Sequence[float], correct: int, errors: int, duration_s: float
+) -> Dict:
+    """Latency, throughput and accuracy of a load test run."""
+    latencies_ms = sorted(latency * 1000 for latency in latencies_s)
+    answered = len(latencies_ms) - errors
+    summary: Dict = {
+        "requests": len(latencies_ms),
+        "errors": errors,
+        "duration_s": duration_s,
+        "throughput_rps": len(latencies_ms) / duration_s if duration_s else 0.0,
+        "accuracy": correct / answered if answered else 0.0,
+    }
+    if latencies_ms:
+        summary["latency_ms"] = {
+            "mean": sum(latencies_ms) / len(latencies_ms),
+            "p50": _percentile(latencies_ms, 50),
+            "p95": _percentile(latencies_ms, 95),
+            "p99": _percentile(latencies_ms, 99),
+            "max": latencies_ms[-1],
+        }
+    return summary
+
+
+def _percentile(sorted_values: Sequence[float], q: float) -> float:
+    # nearest-rank, the locust image comes without numpy
+    rank = max(math.ceil(q / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
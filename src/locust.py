@@ -3,30 +3,56 @@ import json
 import random
 import pathlib
 
-from locust import HttpUser, task
+from locust import HttpUser, events, task
 
-from config.model import FNAME_CLASS
+from src.loadgen import load_payloads
 
 
 IMGS_DIR = pathlib.Path(os.environ["IMGS_DIR"])
-DOG_IDS = FNAME_CLASS.keys()
-JPG_FILES = [
-    x for x in IMGS_DIR.glob("**/*.jpg") if any(map(lambda id_: id_ in str(x), DOG_IDS))
-]
+# Images of every class kept in memory and sent by the users
+PAYLOADS_PER_CLASS = int(os.environ.get("PAYLOADS_PER_CLASS", 100))
+# Path to write the latency/throughput/accuracy summary to on exit
+SUMMARY_PATH = os.environ.get("LOCUST_SUMMARY")
+PAYLOADS = load_payloads(IMGS_DIR, PAYLOADS_PER_CLASS)
+CORRECT_PREDICTIONS = 0
 
 
 class LoadGenerator(HttpUser):
     @task
     def prediction(self) -> None:
-        target_image = random.choice(JPG_FILES)
-        for file_name, sent_breed in FNAME_CLASS.items():
-            if file_name in target_image.name:
-                break
+        global CORRECT_PREDICTIONS
+        target_image = random.choice(PAYLOADS)
 
-        payload = dict(binData=target_image.read_bytes())
+        payload = dict(binData=target_image.data)
         with self.client.post("", files=payload, catch_response=True) as response:
             predicted_breed = json.loads(response.text)["strData"]
-            if sent_breed != predicted_breed:
+            if target_image.label != predicted_breed:
                 response.failure(
-                    f"Incorrect prediction for {target_image.name} ({sent_breed}) got {predicted_breed}."
+                    f"Incorrect prediction for {target_image.name} "
+                    f"({target_image.label}) got {predicted_breed}."
                 )
+            else:
+                CORRECT_PREDICTIONS += 1
+
+
+@events.quitting.add_listener
+def write_summary(environment, **kwargs) -> None:
+    if not SUMMARY_PATH:
+        return
+    total = environment.stats.total
+    duration = (total.last_request_timestamp or total.start_time) - total.start_time
+    summary = {
+        "requests": total.num_requests,
+        "errors": total.num_failures,
+        "duration_s": duration,
+        "throughput_rps": total.num_requests / duration if duration else 0.0,
+        "accuracy": CORRECT_PREDICTIONS / max(total.num_requests, 1),
+        "latency_ms": {
+            "mean": total.avg_response_time,
+            "p50": total.get_response_time_percentile(0.5),
+            "p95": total.get_response_time_percentile(0.95),
+            "p99": total.get_response_time_percentile(0.99),
+            "max": total.max_response_time,
+        },
+    }
+    pathlib.Path(SUMMARY_PATH).write_text(json.dumps(summary, indent=2))
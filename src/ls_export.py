@@ -0,0 +1,81 @@
+"""
+Streaming reader of Label Studio JSON exports.
+
+Kept free of third-party imports, so it runs in any job image.
+"""
+import json
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+
+CHUNK_SIZE = 1024 * 1024
+_WHITESPACE = " \t\n\r"
+
+
+def iter_tasks(export_path: Path, chunk_size: int = CHUNK_SIZE) -> Iterator[Dict]:
+    """
+    Yield the tasks of an export one by one.
+
+    The file is read in chunks, so memory use is bounded by the largest task
+    rather than by the size of the export.
+    """
+    decoder = json.JSONDecoder()
+    with export_path.open(encoding="utf-8") as fd:
+        buffer = ""
+        pos = 0
+        eof = False
+        started = False
+
+        def fill() -> bool:
+            nonlocal buffer, pos, eof
+            chunk = fd.read(chunk_size)
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            eof = not chunk
+            return not eof
+
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE + ",":
+                pos += 1
+            if pos == len(buffer):
+                if not fill():
+                    if not started:
+                        raise ValueError(f"{export_path} is empty")
+                    raise ValueError(f"{export_path} is truncated")
+                continue
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError(f"{export_path} is not a list of tasks")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                task, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof or not fill():
+                    raise
+                continue
+            pos = end
+            yield task
+
+
+def task_label(task: Dict) -> Optional[str]:
+    """Label of the first annotation of a task, None if it has none."""
+    for annotation in task.get("annotations") or ():
+        if annotation.get("was_cancelled"):
+            continue
+        for result in annotation.get("result") or ():
+            choices = result.get("value", {}).get("choices")
+            if choices:
+                return choices[0]
+    return None
+
+
+def iter_labeled(export_path: Path) -> Iterator[Tuple[str, str]]:
+    """Yield (image, label) pairs, skipping tasks without annotations."""
+    for task in iter_tasks(export_path):
+        label = task_label(task)
+        if label is not None:
+            yield task["data"]["image"], label
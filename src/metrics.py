@@ -0,0 +1,85 @@
+import contextlib
+import threading
+import time
+from typing import Dict, Iterator, List, Sequence, Union
+
+import numpy as np
+
+
+# Upper bounds of the latency buckets, 0.1ms to 10s with ~26% steps,
+# the last bucket is unbounded
+BUCKETS_MS = tuple(np.geomspace(0.1, 10000, 51))
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram.
+
+    Recording is a bucket lookup and an increment, percentiles are
+    interpolated linearly within the bucket they fall into.
+    """
+
+    def __init__(self, buckets_ms: Sequence[float] = BUCKETS_MS) -> None:
+        self.bounds = np.array(buckets_ms, dtype=np.float64)
+        self.counts = np.zeros(len(self.bounds) + 1, dtype=np.int64)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value_ms: float) -> None:
+        bucket = int(np.searchsorted(self.bounds, value_ms))
+        with self._lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.total_ms += value_ms
+            self.max_ms = max(self.max_ms, value_ms)
+
+    def percentile(self, q: float) -> float:
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = q / 100 * self.count
+            cumulative = np.cumsum(self.counts)
+            bucket = int(np.searchsorted(cumulative, rank))
+            lower = self.bounds[bucket - 1] if bucket > 0 else 0.0
+            upper = self.bounds[bucket] if bucket < len(self.bounds) else self.max_ms
+            below = cumulative[bucket - 1] if bucket > 0 else 0
+            fraction = (rank - below) / self.counts[bucket]
+            return float(min(lower + (upper - lower) * fraction, self.max_ms))
+
+
+class StageTimings:
+    """Latency histograms of named stages, timed with a monotonic clock."""
+
+    def __init__(self, stages: Sequence[str]) -> None:
+        self.histograms = {stage: LatencyHistogram() for stage in stages}
+
+    @contextlib.contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter() - started) * 1000)
+
+    def observe(self, stage: str, value_ms: float) -> None:
+        self.histograms[stage].observe(value_ms)
+
+    def metrics(self) -> List[Dict[str, Union[str, int, float]]]:
+        """Percentiles and counts of every stage in the Seldon metrics format."""
+        metrics: List[Dict[str, Union[str, int, float]]] = []
+        for stage, histogram in self.histograms.items():
+            metrics.append(
+                {"type": "GAUGE", "key": f"{stage}_count", "value": histogram.count}
+            )
+            for q in PERCENTILES:
+                metrics.append(
+                    {
+                        "type": "GAUGE",
+                        "key": f"{stage}_p{q}_ms",
+                        "value": histogram.percentile(q),
+                    }
+                )
+        return metrics
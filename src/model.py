@@ -1,26 +1,102 @@
+from typing import Callable, Dict, List
+
 from config.preprocessing import INPUT_SIZE
 from keras import models, layers, optimizers
 
 from keras.applications import VGG16
-from config.model import INPUT_LAYER_SHAPE
+from config.model import HEAD, HEAD_UNITS, INPUT_LAYER_SHAPE, LEARNING_RATE
+
+
+def _flatten_head() -> List[layers.Layer]:
+    # the original head, 6.4M parameters in the first dense layer
+    return [
+        layers.Flatten(input_shape=INPUT_LAYER_SHAPE),
+        layers.Dense(HEAD_UNITS, activation="relu"),
+    ]
+
+
+def _project_head() -> List[layers.Layer]:
+    # 1x1 convolution to 64 channels before flattening, 0.8M parameters
+    return [
+        layers.Conv2D(64, 1, activation="relu", input_shape=INPUT_LAYER_SHAPE),
+        layers.Flatten(),
+        layers.Dense(HEAD_UNITS, activation="relu"),
+    ]
+
+
+def _gap_head() -> List[layers.Layer]:
+    # global average pooling, 0.13M parameters
+    return [
+        layers.GlobalAveragePooling2D(input_shape=INPUT_LAYER_SHAPE),
+        layers.Dense(HEAD_UNITS, activation="relu"),
+    ]
+
 
+def _gap_linear_head() -> List[layers.Layer]:
+    # global average pooling straight into the classifier, 1k parameters
+    return [layers.GlobalAveragePooling2D(input_shape=INPUT_LAYER_SHAPE)]
 
-def get_model() -> models.Model:
+
+# Layers between the encoder and the softmax classifier, selected by name
+HEADS: Dict[str, Callable[[], List[layers.Layer]]] = {
+    "flatten": _flatten_head,
+    "project": _project_head,
+    "gap": _gap_head,
+    "gap_linear": _gap_linear_head,
+}
+
+
+def get_model(learning_rate: float = LEARNING_RATE, head: str = HEAD) -> models.Model:
     model = models.Sequential()
     encoder = VGG16(weights="imagenet", include_top=False, input_shape=(*INPUT_SIZE, 3))
     encoder.trainable = False
     model.add(encoder)
-    model.add(layers.Flatten(input_shape=INPUT_LAYER_SHAPE))
-    model.add(layers.Dense(256, activation="relu", input_shape=INPUT_LAYER_SHAPE))
-    model.add(layers.Dense(2, activation="softmax"))
+    for layer in _head_layers(head):
+        model.add(layer)
 
     # Compile model
-    model.compile(
-        optimizer=optimizers.Adam(),
-        loss="sparse_categorical_crossentropy",
-        metrics=["acc"],
-    )
+    _compile(model, learning_rate)
 
     model.summary()
 
     return model
+
+
+def build_head(head: str = HEAD, learning_rate: float = LEARNING_RATE) -> models.Model:
+    """
+    Build a standalone head taking encoder outputs, like `get_head` returns
+    for a full model.
+    """
+    model = models.Sequential(_head_layers(head))
+    _compile(model, learning_rate)
+    return model
+
+
+def get_encoder(model: models.Model) -> models.Model:
+    return model.layers[0]
+
+
+def get_head(model: models.Model) -> models.Model:
+    """
+    Build a model out of everything on top of the frozen encoder.
+
+    The layers are shared with `model`, so fitting the head on precomputed
+    encoder outputs trains the full model as well.
+    """
+    head = models.Sequential(model.layers[1:])
+    _compile(head)
+    return head
+
+
+def _head_layers(head: str) -> List[layers.Layer]:
+    if head not in HEADS:
+        raise ValueError(f"Unknown head {head!r}, expected one of {sorted(HEADS)}")
+    return [*HEADS[head](), layers.Dense(2, activation="softmax")]
+
+
+def _compile(model: models.Model, learning_rate: float = LEARNING_RATE) -> None:
+    model.compile(
+        optimizer=optimizers.Adam(learning_rate=learning_rate),
+        loss="sparse_categorical_crossentropy",
+        metrics=["acc"],
+    )
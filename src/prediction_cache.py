@@ -0,0 +1,92 @@
+import hashlib
+import io
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+import numpy as np
+
+
+class PredictionCache:
+    """
+    LRU cache of predictions keyed by a hash of the raw request payload.
+
+    Bounded by both the number of entries and their approximate size in bytes.
+    The cache is bound to a model id and is cleared once another model is set.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.model_id: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size_bytes = 0
+        self._entries: "OrderedDict[bytes, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def set_model(self, model_id: str) -> None:
+        with self._lock:
+            if model_id != self.model_id:
+                self._entries.clear()
+                self.size_bytes = 0
+                self.model_id = model_id
+
+    def key(self, payload: Any) -> Optional[bytes]:
+        """Hash of the payload or None if it can not be cached."""
+        if not self.enabled:
+            return None
+        digest = hashlib.blake2b(digest_size=16)
+        if isinstance(payload, io.BytesIO):
+            payload = payload.getvalue()
+        if isinstance(payload, np.ndarray):
+            if payload.dtype.hasobject:
+                return None
+            # arrays of the same bytes but another dtype or shape differ
+            digest.update(f"ndarray:{payload.dtype.str}:{payload.shape}:".encode())
+            digest.update(np.ascontiguousarray(payload).tobytes())
+        elif isinstance(payload, bytes):
+            digest.update(b"bytes:" + payload)
+        else:
+            return None
+        return digest.digest()
+
+    def get(self, key: bytes) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: bytes, value: Any, model_id: Optional[str] = None) -> None:
+        """Store a prediction, unless it was made by a model replaced since."""
+        with self._lock:
+            if key in self._entries:
+                return
+            if model_id is not None and model_id != self.model_id:
+                return
+            self._entries[key] = value
+            self.size_bytes += _entry_size(key, value)
+            while (
+                len(self._entries) > self.max_entries
+                or self.size_bytes > self.max_bytes
+            ):
+                evicted_key, evicted_value = self._entries.popitem(last=False)
+                self.size_bytes -= _entry_size(evicted_key, evicted_value)
+                self.evictions += 1
+
+
+def _entry_size(key: bytes, value: Any) -> int:
+    return len(key) + sys.getsizeof(value)
@@ -1,43 +1,103 @@
 import io
-import json
 import logging
 import numpy as np
 from pathlib import Path
 from urllib.parse import urlparse
-from typing import Tuple, Union, List
+from typing import Tuple, Union, List, Optional, Sequence
 
-from keras.preprocessing import image
-from keras.applications import VGG16
-from keras.applications.vgg16 import preprocess_input
 from PIL import Image, ImageOps
 
-from config.preprocessing import INPUT_SIZE
-from config.model import INPUT_LAYER_SHAPE
+from config.preprocessing import INPUT_SIZE, JPEG_DRAFT, PREPROCESS_VERSION
+from src.ls_export import iter_labeled
+
+# Serving imports this module, keep it free of keras imports.
+# Channel means subtracted by keras.applications.vgg16.preprocess_input
+VGG16_MEAN_BGR = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+
+def preprocessing_key() -> str:
+    """Names the decoding of images, caches of decoded pixels are keyed by it."""
+    width, height = INPUT_SIZE
+    return f"{width}x{height}-draft{int(JPEG_DRAFT)}-v{PREPROCESS_VERSION}"
 
 
 def img_to_numpy(
     im: Union[str, Path, io.BytesIO, bytes, np.ndarray],
     target_size: Union[int, int],
+    draft: bool = JPEG_DRAFT,
 ) -> np.ndarray:
+    """
+    Decode an image and resize it to `target_size`.
+
+    With `draft`, JPEGs are decoded by the DCT-domain downscaling of the decoder
+    at the smallest scale which is still not below `target_size`.
+    Images smaller than twice `target_size` (like most Stanford Dogs images)
+    are decoded at full scale, so the output is the same as without `draft`.
+    For larger ones the mean absolute difference against the full decode is
+    0.23 intensity levels on smooth gradients but 40.8 per channel on a
+    1200x1000 uniform noise JPEG, which the NEAREST resize of the full image
+    aliases (see tests/test_preprocessing.py). Off by default for that reason.
+    """
     if isinstance(im, np.ndarray):
         return im
+    return resize_image(decode_image(im, target_size, draft), target_size)
+
+
+def imgs_to_numpy(
+    ims: Sequence[Union[str, Path, io.BytesIO, bytes, np.ndarray]],
+    target_size: Union[int, int],
+    draft: bool = JPEG_DRAFT,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Batch variant of `img_to_numpy`, decodes straight into one
+    `(N, *target_size, 3)` float32 array (allocated unless `out` is passed).
+    """
+    if out is None:
+        out = np.empty((len(ims), *target_size, 3), dtype=np.float32)
+    for i, im in enumerate(ims):
+        if isinstance(im, np.ndarray):
+            out[i] = im
+        else:
+            out[i] = resize_image(decode_image(im, target_size, draft), target_size)
+    return out
+
+
+def decode_image(
+    im: Union[str, Path, io.BytesIO, bytes],
+    target_size: Union[int, int],
+    draft: bool = JPEG_DRAFT,
+) -> Image.Image:
     if isinstance(im, bytes):
-        img_pil = Image.open(io.BytesIO(im))
-    if isinstance(im, (str, Path, io.BytesIO)):
-        img_pil = Image.open(im)
-        # capture and ignore this bug:
-        # https://github.com/python-pillow/Pillow/issues/3973
-        try:
-            img_pil = ImageOps.exif_transpose(image)
-        except Exception:
-            pass
-    if not isinstance(im, (str, Path, io.BytesIO, bytes, np.ndarray)):
+        im = io.BytesIO(im)
+    if not isinstance(im, (str, Path, io.BytesIO)):
         raise ValueError(f"Unexpected input type: {type(im)}")
+    img_pil = Image.open(im)
+    if draft:
+        img_pil.draft("RGB", target_size)
+    # every input is rotated by its EXIF orientation, so training and serving
+    # see the same pixels; capture and ignore this bug:
+    # https://github.com/python-pillow/Pillow/issues/3973
+    try:
+        img_pil = ImageOps.exif_transpose(img_pil)
+    except Exception:
+        pass
+    img_pil.load()
+    return img_pil
+
+
+def resize_image(img_pil: Image.Image, target_size: Union[int, int]) -> np.ndarray:
     # Keras does not allow to process images in form of bytes
     # https://github.com/keras-team/keras/issues/11684
     img_pil = img_pil.convert("RGB")
-    img_pil = img_pil.resize(INPUT_SIZE, Image.NEAREST)
-    return image.img_to_array(img_pil)
+    img_pil = img_pil.resize(target_size, Image.NEAREST)
+    return np.asarray(img_pil, dtype=np.float32)
+
+
+def preprocess_input(x: np.ndarray) -> np.ndarray:
+    """NumPy version of `keras.applications.vgg16.preprocess_input`: RGB to BGR
+    and zero-centering by the ImageNet channel means."""
+    return x[..., ::-1] - VGG16_MEAN_BGR
 
 
 def _preprocess(X: np.ndarray) -> np.ndarray:
@@ -46,11 +106,48 @@ def _preprocess(X: np.ndarray) -> np.ndarray:
     return X
 
 
-def split_json(dataset_description: Path) -> Tuple[List[str], List[int]]:
-    raw_data = json.loads(dataset_description.read_text())
+def split_json(
+    dataset_description: Path, index_path: Optional[Path] = None
+) -> Tuple[List[str], List[str]]:
+    """
+    Images and labels of the annotated tasks of a Label Studio export.
+
+    The export is parsed incrementally and the pairs are stored in a columnar
+    index, by default next to it, which is used while the export is unchanged.
+    """
+    if index_path is None:
+        index_path = dataset_description.with_suffix(".index.npz")
+    stat = dataset_description.stat()
+    stamp = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    try:
+        with np.load(index_path, allow_pickle=False) as index:
+            if np.array_equal(index["stamp"], stamp):
+                return index["images"].tolist(), index["labels"].tolist()
+    except (OSError, KeyError, ValueError):
+        pass
+
     images = []
     labels = []
-    for item in raw_data:
-        images.append(item["data"]["image"])
-        labels.append(item["annotations"][0]["result"][0]["value"]["choices"][0])
+    for image, label in iter_labeled(dataset_description):
+        images.append(image)
+        labels.append(label)
+    _write_index(index_path, stamp, images, labels)
     return images, labels
+
+
+def _write_index(
+    index_path: Path, stamp: np.ndarray, images: List[str], labels: List[str]
+) -> None:
+    tmp_path = index_path.with_name(index_path.name + ".tmp")
+    try:
+        with tmp_path.open("wb") as fd:
+            np.savez(
+                fd,
+                stamp=stamp,
+                images=np.array(images, dtype=str),
+                labels=np.array(labels, dtype=str),
+            )
+        tmp_path.replace(index_path)
+    except OSError:
+        # read-only dataset mount, parse the export every time
+        logging.warning("Could not write the export index %s", index_path)
@@ -0,0 +1,149 @@
+import logging
+import resource
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+import mlflow
+import numpy as np
+from keras.callbacks import Callback
+from keras.utils import Sequence
+
+from config.model import PROFILE_LOG_EVERY
+
+
+logger = logging.getLogger(__name__)
+
+Batch = Tuple[np.ndarray, np.ndarray]
+
+
+class ThroughputProfiler(Callback):
+    """
+    Keras callback splitting training time into the wait on the input and
+    the train step, with images per second and peak RSS.
+
+    The input is timed by wrapping it with `wrap`: the time it takes to hand
+    out a batch is the wait on the input, the rest of the batch is the step.
+    As Keras may fetch the next batch while the current step runs, the split
+    is exact only for the totals of a window. Batches are summed up and
+    logged to MLflow every `log_every` batches and per epoch, so the overhead
+    is a few clock reads per batch.
+    """
+
+    def __init__(
+        self, log_every: int = PROFILE_LOG_EVERY, batch_size: Optional[int] = None
+    ) -> None:
+        super().__init__()
+        self.log_every = max(log_every, 1)
+        # images per batch of an input which is not wrapped
+        self.batch_size = batch_size
+        self._wrapped = False
+        self._lock = threading.Lock()
+        self._wait_s = 0.0
+        self._images = 0
+        self._global_batch = 0
+        self._batch_started = 0.0
+        self._window = self._totals()
+        self._epoch = self._totals()
+
+    def wrap(self, data):
+        """
+        Time a `Sequence` or an iterator of batches passed to `fit`. Other
+        inputs, like datasets, are returned as is and run within the step.
+        """
+        if isinstance(data, Sequence):
+            self._wrapped = True
+            return _TimedSequence(data, self)
+        if isinstance(data, Iterator):
+            self._wrapped = True
+            return self._timed_iterator(data)
+        return data
+
+    def on_train_batch_begin(self, batch: int, logs: Optional[Dict] = None) -> None:
+        self._batch_started = time.perf_counter()
+
+    def on_train_batch_end(self, batch: int, logs: Optional[Dict] = None) -> None:
+        batch_s = time.perf_counter() - self._batch_started
+        with self._lock:
+            wait_s, self._wait_s = self._wait_s, 0.0
+            images, self._images = self._images, 0
+        if not self._wrapped:
+            images = self.batch_size or 0
+        for totals in (self._window, self._epoch):
+            totals["batches"] += 1
+            totals["wait_s"] += wait_s
+            totals["batch_s"] += batch_s
+            totals["images"] += images
+        self._global_batch += 1
+        if self._global_batch % self.log_every == 0:
+            mlflow.log_metrics(
+                self._metrics(self._window, "batch_"), step=self._global_batch
+            )
+            self._window = self._totals()
+
+    def on_epoch_begin(self, epoch: int, logs: Optional[Dict] = None) -> None:
+        self._epoch = self._totals()
+
+    def on_epoch_end(self, epoch: int, logs: Optional[Dict] = None) -> None:
+        metrics = self._metrics(self._epoch, "epoch_")
+        mlflow.log_metrics(metrics, step=epoch)
+        logger.info(
+            "Epoch %d: %.1f images/s, %.1fs waiting on the input, "
+            "%.1fs in train steps, peak RSS %.0fMB",
+            epoch,
+            metrics["epoch_images_per_s"],
+            metrics.get("epoch_input_wait_s", 0.0),
+            metrics["epoch_step_s"],
+            metrics["epoch_peak_rss_mb"],
+        )
+
+    def _timed_iterator(self, iterator: Iterator[Batch]) -> Iterator[Batch]:
+        while True:
+            started = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            self._record(time.perf_counter() - started, batch)
+            yield batch
+
+    def _record(self, wait_s: float, batch: Batch) -> None:
+        with self._lock:
+            self._wait_s += wait_s
+            self._images += len(batch[1])
+
+    @staticmethod
+    def _totals() -> Dict[str, float]:
+        return {"batches": 0, "wait_s": 0.0, "batch_s": 0.0, "images": 0}
+
+    def _metrics(self, totals: Dict[str, float], prefix: str) -> Dict[str, float]:
+        wait_s = min(totals["wait_s"], totals["batch_s"])
+        # ru_maxrss is in kilobytes on Linux
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        metrics = {
+            f"{prefix}step_s": totals["batch_s"] - wait_s,
+            f"{prefix}images_per_s": totals["images"] / max(totals["batch_s"], 1e-9),
+            f"{prefix}peak_rss_mb": peak_rss_kb / 1024,
+        }
+        if self._wrapped:
+            metrics[f"{prefix}input_wait_s"] = wait_s
+        return metrics
+
+
+class _TimedSequence(Sequence):
+    def __init__(self, sequence: Sequence, profiler: ThroughputProfiler) -> None:
+        super().__init__()
+        self.sequence = sequence
+        self.profiler = profiler
+
+    def __len__(self) -> int:
+        return len(self.sequence)
+
+    def __getitem__(self, i: int) -> Batch:
+        started = time.perf_counter()
+        batch = self.sequence[i]
+        self.profiler._record(time.perf_counter() - started, batch)
+        return batch
+
+    def on_epoch_end(self) -> None:
+        self.sequence.on_epoch_end()
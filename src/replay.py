@@ -0,0 +1,142 @@
+"""
+Replay a recorded request trace against the model endpoint.
+
+The trace is a JSON lines file, every line is a request like
+`{"timestamp": 1618000000.25, "image": "n02085936_1003.jpg"}`.
+Requests are sent at their recorded offsets divided by `--speed`
+(0 sends them as fast as `--concurrency` allows) and a latency, throughput
+and accuracy summary is written at the end. Timed replays measure latencies
+from the time a request is due, not the time it is sent, so requests held
+back by a slow endpoint or busy workers are not under-reported
+(coordinated omission).
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from src.loadgen import image_label, summarize
+
+
+_session = threading.local()
+
+
+def load_trace(trace_path: pathlib.Path) -> List[Dict]:
+    with trace_path.open() as fd:
+        trace = [json.loads(line) for line in fd if line.strip()]
+    return sorted(trace, key=lambda event: event["timestamp"])
+
+
+def load_images(imgs_dir: pathlib.Path, names: List[str]) -> Dict[str, bytes]:
+    """Read every image of the trace into memory once, looking them up by name."""
+    wanted = set(names)
+    payloads = {}
+    for root, _, files in os.walk(imgs_dir):
+        for name in wanted.intersection(files):
+            payloads[name] = (pathlib.Path(root) / name).read_bytes()
+    missing = wanted - payloads.keys()
+    if missing:
+        raise ValueError(f"{len(missing)} trace images not found, e.g. {missing.pop()}")
+    return payloads
+
+
+def replay(args: argparse.Namespace) -> Dict:
+    trace = load_trace(args.trace)
+    payloads = load_images(args.imgs_dir, [event["image"] for event in trace])
+
+    results: List[Tuple[float, bool, bool]] = []
+    lags: List[float] = []
+    started = time.perf_counter()
+    first_timestamp = trace[0]["timestamp"] if trace else 0.0
+
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        futures = []
+        for event in trace:
+            due = None
+            if args.speed:
+                due = started + (event["timestamp"] - first_timestamp) / args.speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                lags.append(max(-delay, 0.0))
+            label = event.get("label") or image_label(event["image"])
+            payload = payloads[event["image"]]
+            futures.append(executor.submit(_send, args.endpoint, payload, label, due))
+        results = [future.result() for future in futures]
+    duration = time.perf_counter() - started
+
+    summary = summarize(
+        [latency for latency, _, _ in results],
+        correct=sum(correct for _, _, correct in results),
+        errors=sum(failed for _, failed, _ in results),
+        duration_s=duration,
+    )
+    if lags:
+        summary["max_schedule_lag_ms"] = max(lags) * 1000
+    return summary
+
+
+def _send(
+    endpoint: str, payload: bytes, label: Optional[str], due: Optional[float]
+) -> Tuple[float, bool, bool]:
+    """
+    Post an image, return the latency since it was `due` (a perf_counter time)
+    or sent, whether it failed and was predicted right.
+    """
+    if not hasattr(_session, "session"):
+        _session.session = requests.Session()
+    started = time.perf_counter() if due is None else due
+    try:
+        response = _session.session.post(endpoint, files=dict(binData=payload))
+        latency = time.perf_counter() - started
+        response.raise_for_status()
+        predicted = response.json()["strData"]
+    except (requests.RequestException, ValueError, KeyError):
+        return time.perf_counter() - started, True, False
+    return latency, False, predicted == label
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replay a recorded request trace")
+    parser.add_argument(
+        "-e", "--endpoint", required=True, help="Prediction endpoint URL"
+    )
+    parser.add_argument(
+        "-t", "--trace", required=True, type=pathlib.Path, help="JSON lines trace"
+    )
+    parser.add_argument(
+        "-i",
+        "--imgs_dir",
+        required=True,
+        type=pathlib.Path,
+        help="Folder with the images of the trace",
+    )
+    parser.add_argument(
+        "-s",
+        "--speed",
+        default=1.0,
+        type=float,
+        help="Timing scale, 2 replays twice as fast, 0 as fast as possible",
+    )
+    parser.add_argument(
+        "-c", "--concurrency", default=32, type=int, help="Maximum requests in flight"
+    )
+    parser.add_argument(
+        "-o", "--summary", type=pathlib.Path, help="Path to write the JSON summary to"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    summary = json.dumps(replay(args), indent=2)
+    print(summary)
+    if args.summary:
+        args.summary.write_text(summary)
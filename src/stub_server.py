@@ -0,0 +1,90 @@
+"""
+Local stand-in for the model server, to run the load generators offline.
+
+Answers `POST` requests in the Seldon format. If `--imgs_dir` is given,
+posted images found there are answered with their true breed.
+"""
+
+import argparse
+import hashlib
+import json
+import pathlib
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+from config.model import ENCODING_CLASS
+from src.loadgen import image_label
+
+
+def known_labels(imgs_dir: Optional[pathlib.Path]) -> Dict[bytes, str]:
+    labels: Dict[bytes, str] = {}
+    if imgs_dir is None:
+        return labels
+    for path in imgs_dir.glob("**/*.jpg"):
+        label = image_label(path.name)
+        if label is not None:
+            labels[_digest(path.read_bytes())] = label
+    return labels
+
+
+def make_handler(labels: Dict[bytes, str], latency_ms: float) -> type:
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            payload = _multipart_file(body, self.headers.get("Content-Type", ""))
+            if latency_ms:
+                time.sleep(latency_ms / 1000)
+            label = labels.get(_digest(payload), ENCODING_CLASS[0])
+            response = json.dumps({"meta": {}, "strData": label}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    return StubHandler
+
+
+def _multipart_file(body: bytes, content_type: str) -> bytes:
+    """Content of the first part of a multipart body, the body itself otherwise."""
+    if "boundary=" not in content_type:
+        return body
+    boundary = content_type.split("boundary=")[1].strip('"').encode()
+    part = body.split(b"--" + boundary)[1]
+    return part.split(b"\r\n\r\n", 1)[1][: -len(b"\r\n")]
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Stand-in model server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", default=5000, type=int)
+    parser.add_argument(
+        "-i",
+        "--imgs_dir",
+        type=pathlib.Path,
+        help="Images to answer with their true breed",
+    )
+    parser.add_argument(
+        "-l",
+        "--latency_ms",
+        default=0.0,
+        type=float,
+        help="Simulated inference time per request",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    handler = make_handler(known_labels(args.imgs_dir), args.latency_ms)
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"Serving on http://{args.host}:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,298 @@
+"""
+Hyperparameter sweep of the classifier head over cached encoder features.
+
+    python src/sweep.py -d data/Images -f data/result.json \
+        --features_cache cache/features --trials 27 -o sweep.json
+
+The encoder runs once per image, then trials train heads on the memory-mapped
+features in a pool of processes. Losing trials are stopped by successive
+halving: after every rung only the best 1/eta of the trials continue, for eta
+times as many epochs. Every trial is logged as a nested MLflow run.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import pathlib
+import random as rn
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import mlflow
+import numpy as np
+import tensorflow as tf
+from keras import models
+from mlflow.tracking import MlflowClient
+from mlflow.utils.mlflow_tags import MLFLOW_PARENT_RUN_ID, MLFLOW_RUN_NAME
+from sklearn.model_selection import train_test_split
+
+from config.model import (
+    BATCH_SIZE,
+    CLASS_ENCODING,
+    INPUT_LAYER_SHAPE,
+    LEARNING_RATE,
+    RD_SEED,
+    SPLIT_SEED,
+    TEST_SIZE,
+)
+from src.dataset import image_path
+from src.features import FeatureCache, FeaturesDataset
+from src.model import HEADS, build_head, get_encoder, get_model
+from src.preprocessing import split_json
+
+
+def sample_trials(args: argparse.Namespace) -> List[Dict]:
+    """Random hyperparameters, the learning rate is drawn log-uniformly."""
+    rng = rn.Random(args.seed)
+    log_min, log_max = math.log10(args.lr_min), math.log10(args.lr_max)
+    return [
+        {
+            "head": rng.choice(args.heads),
+            "learning_rate": 10 ** rng.uniform(log_min, log_max),
+            "batch_size": rng.choice(args.batch_sizes),
+        }
+        for _ in range(args.trials)
+    ]
+
+
+def rung_epochs(min_epochs: int, max_epochs: int, eta: int) -> List[int]:
+    """Epochs the trials of every rung are trained up to."""
+    epochs = []
+    budget = min_epochs
+    while budget < max_epochs:
+        epochs.append(budget)
+        budget *= eta
+    return epochs + [max_epochs]
+
+
+def sweep(args: argparse.Namespace) -> Dict:
+    images, labels = split_json(args.data_description)
+    # the same split as in training
+    X_train, X_test, Y_train, Y_test = train_test_split(
+        images, labels, test_size=TEST_SIZE, stratify=labels, random_state=SPLIT_SEED
+    )
+    cache = FeatureCache(args.features_cache, get_encoder(get_model()))
+    train_rows = cache.rows([image_path(args.data_dir, x) for x in X_train])
+    test_rows = cache.rows([image_path(args.data_dir, x) for x in X_test])
+
+    trials = sample_trials(args)
+    rungs = rung_epochs(args.min_epochs, args.max_epochs, args.eta)
+    scores: Dict[int, float] = {}
+    client = MlflowClient()
+    with tempfile.TemporaryDirectory() as work_dir, mlflow.start_run() as parent:
+        split_path = pathlib.Path(work_dir) / "split.npz"
+        np.savez(
+            split_path,
+            train_rows=train_rows,
+            test_rows=test_rows,
+            train_labels=Y_train,
+            test_labels=Y_test,
+        )
+        mlflow.log_params(
+            {"trials": args.trials, "eta": args.eta, "max_epochs": args.max_epochs}
+        )
+        run_ids = []
+        for trial, params in enumerate(trials):
+            run = client.create_run(
+                parent.info.experiment_id,
+                tags={
+                    MLFLOW_PARENT_RUN_ID: parent.info.run_id,
+                    MLFLOW_RUN_NAME: f"trial-{trial}",
+                },
+            )
+            for key, value in params.items():
+                client.log_param(run.info.run_id, key, value)
+            run_ids.append(run.info.run_id)
+
+        def task(trial: int, initial_epoch: int, epochs: int) -> Dict:
+            return {
+                "params": trials[trial],
+                "seed": RD_SEED + trial,
+                "features": cache.features.filename,
+                "split": str(split_path),
+                "checkpoint": str(pathlib.Path(work_dir) / f"trial-{trial}.h5"),
+                "initial_epoch": initial_epoch,
+                "epochs": epochs,
+            }
+
+        # spawned, forking a process which has run TF is unsafe
+        context = multiprocessing.get_context("spawn")
+        threads = max((os.cpu_count() or 1) // args.workers, 1)
+        alive = list(range(len(trials)))
+        with ProcessPoolExecutor(
+            args.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(threads,),
+        ) as pool:
+            initial_epoch = 0
+            for rung, epochs in enumerate(rungs):
+                futures = {
+                    trial: pool.submit(run_trial, task(trial, initial_epoch, epochs))
+                    for trial in alive
+                }
+                for trial, future in futures.items():
+                    try:
+                        history = future.result()
+                    except Exception as e:
+                        print(f"Trial {trial} failed: {e!r}")
+                        client.set_terminated(run_ids[trial], "FAILED")
+                        scores.pop(trial, None)
+                        continue
+                    for epoch, metrics in enumerate(history, start=initial_epoch):
+                        for key, value in metrics.items():
+                            client.log_metric(run_ids[trial], key, value, step=epoch)
+                    scores[trial] = history[-1]["val_acc"]
+                initial_epoch = epochs
+
+                alive = sorted(
+                    (trial for trial in alive if trial in scores),
+                    key=lambda trial: scores[trial],
+                    reverse=True,
+                )
+                if not alive:
+                    raise RuntimeError("Every trial of the sweep failed")
+                print(
+                    f"Rung {rung}: {len(futures)} trials trained to {epochs} epochs, "
+                    f"best val_acc {scores[alive[0]]:.3f}"
+                )
+                if rung < len(rungs) - 1:
+                    keep = max(len(alive) // args.eta, 1)
+                    for trial in alive[keep:]:
+                        client.set_tag(run_ids[trial], "stopped_at_epoch", epochs)
+                        client.set_terminated(run_ids[trial], "KILLED")
+                    alive = alive[:keep]
+
+        for trial in alive:
+            client.set_terminated(run_ids[trial])
+        best = alive[0]
+        mlflow.log_metric("best_val_acc", scores[best])
+        mlflow.log_params({f"best_{k}": v for k, v in trials[best].items()})
+
+    return {
+        "best": {"trial": best, "val_acc": scores[best], **trials[best]},
+        "trials": [
+            {"trial": trial, "val_acc": scores.get(trial), **params}
+            for trial, params in enumerate(trials)
+        ],
+    }
+
+
+def _init_worker(threads: int) -> None:
+    # the workers share the cores instead of each claiming all of them
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def run_trial(task: Dict) -> List[Dict[str, float]]:
+    """
+    Train a trial up to `task["epochs"]` in a pool worker, resuming from its
+    checkpoint of the previous rung. Returns the metrics of every epoch.
+    """
+    np.random.seed(task["seed"])
+    tf.random.set_seed(task["seed"])
+    rn.seed(task["seed"])
+
+    params = task["params"]
+    features = np.memmap(task["features"], dtype=np.float32, mode="r")
+    features = features.reshape(-1, *INPUT_LAYER_SHAPE)
+    split = np.load(task["split"])
+    checkpoint = pathlib.Path(task["checkpoint"])
+    if checkpoint.exists():
+        # the optimizer state is saved along, training goes on where it stopped
+        model = models.load_model(str(checkpoint))
+    else:
+        model = build_head(params["head"], params["learning_rate"])
+
+    history = model.fit(
+        FeaturesDataset(
+            features,
+            split["train_rows"],
+            list(split["train_labels"]),
+            CLASS_ENCODING,
+            params["batch_size"],
+        ),
+        initial_epoch=task["initial_epoch"],
+        epochs=task["epochs"],
+        validation_data=FeaturesDataset(
+            features, split["test_rows"], list(split["test_labels"]), CLASS_ENCODING
+        ),
+        verbose=0,
+    )
+    model.save(str(checkpoint))
+    return [
+        {key: float(values[i]) for key, values in history.history.items()}
+        for i in range(len(history.epoch))
+    ]
+
+
+def get_args(provided_args: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Sweep the head hyperparameters over cached encoder features"
+    )
+    parser.add_argument(
+        "-d", "--data_dir", required=True, type=pathlib.Path, help="Path to the dataset"
+    )
+    parser.add_argument(
+        "-f",
+        "--data_description",
+        required=True,
+        type=pathlib.Path,
+        help="Path to the dataset description file",
+    )
+    parser.add_argument(
+        "--features_cache",
+        required=True,
+        type=pathlib.Path,
+        help="Folder caching the encoder outputs, shared with training",
+    )
+    parser.add_argument(
+        "-o", "--output", type=pathlib.Path, help="Path to write the JSON results to"
+    )
+    parser.add_argument(
+        "--trials", default=27, type=int, help="Number of sampled configurations"
+    )
+    parser.add_argument(
+        "--workers",
+        default=os.cpu_count() or 1,
+        type=int,
+        help="Number of trials trained at once",
+    )
+    parser.add_argument(
+        "--eta",
+        default=3,
+        type=int,
+        help="Only the best 1/eta of the trials continue after every rung",
+    )
+    parser.add_argument(
+        "--min_epochs", default=1, type=int, help="Epochs of the first rung"
+    )
+    parser.add_argument(
+        "--max_epochs", default=9, type=int, help="Epochs of the remaining trials"
+    )
+    parser.add_argument(
+        "--heads", default=sorted(HEADS), nargs="+", choices=sorted(HEADS)
+    )
+    parser.add_argument("--lr_min", default=LEARNING_RATE / 10, type=float)
+    parser.add_argument("--lr_max", default=LEARNING_RATE * 10, type=float)
+    parser.add_argument(
+        "--batch_sizes",
+        default=[BATCH_SIZE // 2, BATCH_SIZE, BATCH_SIZE * 2],
+        type=int,
+        nargs="+",
+    )
+    parser.add_argument("--seed", default=RD_SEED, type=int)
+    args = parser.parse_args(provided_args)
+    if args.eta < 2:
+        raise ValueError("--eta must be at least 2")
+    return args
+
+
+if __name__ == "__main__":
+    args = get_args()
+    results = sweep(args)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    print(f"Best trial: {json.dumps(results['best'])}")
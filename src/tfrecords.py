@@ -0,0 +1,209 @@
+"""
+Pack the labeled dataset into compressed TFRecord shards and stream them back.
+
+    python src/tfrecords.py -d data/Images -f data/result.json -o data/records
+
+Every split is written to fixed-size shards of original JPEG bytes and labels.
+`manifest.json` lists the shards with their sample counts and class balance,
+along with the fingerprint of the exported dataset, see `src/fingerprint.py`.
+"""
+import argparse
+import io
+import json
+import pathlib
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+import tensorflow as tf
+from sklearn.model_selection import train_test_split
+
+from config.model import BATCH_SIZE, CLASS_ENCODING, RD_SEED, SPLIT_SEED, TEST_SIZE
+from config.preprocessing import (
+    INPUT_SIZE,
+    TFRECORD_COMPRESSION,
+    TFRECORD_SHARD_SIZE,
+    TFRECORD_SHUFFLE_BUFFER,
+)
+from src.dataset import image_path
+from src.fingerprint import fingerprint
+from src.preprocessing import img_to_numpy, preprocess_input, split_json
+
+
+MANIFEST_NAME = "manifest.json"
+FEATURES = {
+    "image": tf.io.FixedLenFeature([], tf.string),
+    "label": tf.io.FixedLenFeature([], tf.int64),
+}
+
+
+def export(args: argparse.Namespace) -> Dict:
+    images, labels = split_json(args.data_description)
+    # the same split as in training
+    X_train, X_test, Y_train, Y_test = train_test_split(
+        images, labels, test_size=TEST_SIZE, stratify=labels, random_state=SPLIT_SEED
+    )
+    args.output.mkdir(parents=True, exist_ok=True)
+    manifest = {
+        "dataset_fingerprint": fingerprint(zip(images, labels)),
+        "compression": args.compression,
+        "class_encoding": CLASS_ENCODING,
+        "splits": {
+            "train": write_split(args, "train", X_train, Y_train),
+            "test": write_split(args, "test", X_test, Y_test),
+        },
+    }
+    (args.output / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+def write_split(
+    args: argparse.Namespace, split: str, images: List[str], labels: List[str]
+) -> Dict:
+    options = tf.io.TFRecordOptions(compression_type=args.compression)
+    num_shards = max(-(-len(images) // args.shard_size), 1)
+    shards = []
+    for shard in range(num_shards):
+        name = f"{split}-{shard:05d}-of-{num_shards:05d}.tfrecord"
+        shard_slice = slice(shard * args.shard_size, (shard + 1) * args.shard_size)
+        samples = list(zip(images[shard_slice], labels[shard_slice]))
+        # written under a temporary name, so a crash leaves no valid looking shard
+        tmp_path = args.output / (name + ".tmp")
+        with tf.io.TFRecordWriter(str(tmp_path), options) as writer:
+            for image, label in samples:
+                example = tf.train.Example(
+                    features=tf.train.Features(
+                        feature={
+                            "image": _bytes_feature(
+                                image_path(args.data_dir, image).read_bytes()
+                            ),
+                            "label": _int64_feature(CLASS_ENCODING[label]),
+                        }
+                    )
+                )
+                writer.write(example.SerializeToString())
+        tmp_path.replace(args.output / name)
+        shards.append({"file": name, "samples": len(samples)})
+    return {
+        "samples": len(images),
+        "classes": dict(Counter(labels)),
+        "shards": shards,
+    }
+
+
+def read_manifest(
+    records_dir: pathlib.Path, dataset_fingerprint: Optional[str] = None
+) -> Dict:
+    """
+    Read the manifest of exported shards, checking they were exported from
+    the dataset of `dataset_fingerprint` when it is given.
+    """
+    manifest = json.loads((records_dir / MANIFEST_NAME).read_text())
+    if manifest["class_encoding"] != CLASS_ENCODING:
+        raise ValueError(
+            f"{records_dir} was exported with classes {manifest['class_encoding']}"
+        )
+    exported = manifest.get("dataset_fingerprint")
+    if dataset_fingerprint is not None and exported != dataset_fingerprint:
+        raise ValueError(
+            f"{records_dir} was exported from another dataset (fingerprint "
+            f"{exported}), export it again with src/tfrecords.py"
+        )
+    return manifest
+
+
+def records_dataset(
+    records_dir: pathlib.Path,
+    split: str,
+    batch_size: int = BATCH_SIZE,
+    shuffle: bool = True,
+    seed: Optional[int] = RD_SEED,
+) -> tf.data.Dataset:
+    """
+    Stream a split of the exported shards: several shards are read at once,
+    samples are shuffled within a buffer and decoded in parallel.
+    """
+    manifest = read_manifest(records_dir)
+    shards = manifest["splits"][split]["shards"]
+    paths = [str(records_dir / shard["file"]) for shard in shards]
+
+    files = tf.data.Dataset.from_tensor_slices(paths)
+    if shuffle:
+        files = files.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+    dataset = files.interleave(
+        lambda path: tf.data.TFRecordDataset(
+            path, compression_type=manifest["compression"], buffer_size=8 * 1024 ** 2
+        ),
+        cycle_length=min(len(paths), 8),
+        num_parallel_calls=tf.data.experimental.AUTOTUNE,
+        deterministic=not shuffle,
+    )
+    if shuffle:
+        dataset = dataset.shuffle(TFRECORD_SHUFFLE_BUFFER, seed=seed)
+    return (
+        dataset.map(_parse, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        .batch(batch_size)
+        .prefetch(tf.data.experimental.AUTOTUNE)
+    )
+
+
+def _parse(record: tf.Tensor):
+    example = tf.io.parse_single_example(record, FEATURES)
+    # decoded like at serving time, rather than with tf.image ops
+    image = tf.numpy_function(_decode, [example["image"]], tf.float32)
+    image.set_shape((*INPUT_SIZE, 3))
+    return image, example["label"]
+
+
+def _decode(data: bytes) -> np.ndarray:
+    return preprocess_input(img_to_numpy(io.BytesIO(data), target_size=INPUT_SIZE))
+
+
+def _bytes_feature(value: bytes) -> tf.train.Feature:
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+
+
+def _int64_feature(value: int) -> tf.train.Feature:
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
+
+
+def get_args(provided_args: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Export the labeled dataset to sharded TFRecord files"
+    )
+    parser.add_argument(
+        "-d", "--data_dir", required=True, type=pathlib.Path, help="Path to the dataset"
+    )
+    parser.add_argument(
+        "-f",
+        "--data_description",
+        required=True,
+        type=pathlib.Path,
+        help="Path to the dataset description file",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        required=True,
+        type=pathlib.Path,
+        help="Folder to write the shards and the manifest to",
+    )
+    parser.add_argument(
+        "--shard_size",
+        default=TFRECORD_SHARD_SIZE,
+        type=int,
+        help="Number of samples per shard",
+    )
+    parser.add_argument(
+        "--compression",
+        default=TFRECORD_COMPRESSION,
+        choices=("GZIP", "ZLIB", ""),
+        help="Compression of the shards",
+    )
+    return parser.parse_args(provided_args)
+
+
+if __name__ == "__main__":
+    manifest = export(get_args())
+    for split, info in manifest["splits"].items():
+        print(f"{split}: {info['samples']} samples in {len(info['shards'])} shards")
@@ -1,8 +1,11 @@
 import argparse
+import json
+import logging
 import random as rn
 import pathlib
-from src.dataset import DogsDataset
-from typing import Optional, List
+import tempfile
+from src.dataset import DogsDataset, image_path
+from typing import Any, Dict, Optional, List, Tuple
 
 import tensorflow as tf
 import numpy as np
@@ -10,14 +13,35 @@ import mlflow
 from sklearn.model_selection import train_test_split
 
 from src.preprocessing import split_json
-from src.model import get_model
+from src.model import HEADS, get_model, get_encoder, get_head
+from src.features import FeatureCache, FeaturesDataset
+from src.incremental import TrainState, fine_tune_images, hash_split
+from src.fingerprint import fingerprint, write_fingerprint
+from src.dedup import DuplicateIndex, hash_images
+from src.profiling import ThroughputProfiler
+from src.distributed import distribute, get_strategy, is_chief, worker_index
+from src.tfrecords import read_manifest, records_dataset
+from src.image_cache import ImageShardCache
+from src.loader import PrefetchLoader
 from config.model import (
+    BATCH_SIZE,
     CLASS_ENCODING,
+    DRIFT_THRESHOLD,
+    HEAD,
+    INCREMENTAL_STEPS,
+    LEARNING_RATE,
     RD_SEED,
     SPLIT_SEED,
     TEST_SIZE,
     EPOCHS,
+    LOADER_WORKERS,
+    PREFETCH_BATCHES,
+    PROFILE_LOG_EVERY,
 )
+from config.preprocessing import IMAGE_CACHE_MAX_BYTES
+
+
+logger = logging.getLogger(__name__)
 
 
 def train(args: argparse.Namespace) -> None:
@@ -25,43 +49,387 @@ def train(args: argparse.Namespace) -> None:
     Training script copied from here
     https://github.com/elleobrien/Dog_Breed_Classifier/blob/master/breed_classifier.py
     """
+    # created first, before any other TF operation
+    strategy = get_strategy() if args.distributed else None
+
     np.random.seed(RD_SEED)
     tf.random.set_seed(RD_SEED)
     rn.seed(RD_SEED)
 
-    mlflow.log_metric("test_size", TEST_SIZE)
+    # only the chief worker logs to MLflow
+    chief = is_chief()
+    if chief:
+        mlflow.log_metric("test_size", TEST_SIZE)
+        mlflow.log_param("head", args.head)
     images, labels = split_json(args.data_description)
+    dataset_fingerprint = fingerprint(zip(images, labels))
+    if chief:
+        mlflow.log_param("dataset_fingerprint", dataset_fingerprint)
+    if args.tfrecords:
+        # the shards have to hold the training set of --data_description
+        read_manifest(args.tfrecords, dataset_fingerprint)
+
+    if strategy is not None:
+        with strategy.scope():
+            model = get_model(
+                LEARNING_RATE * strategy.num_replicas_in_sync, head=args.head
+            )
+    else:
+        model = get_model(head=args.head)
+
+    state = samples = None
+    if args.incremental:
+        state = TrainState(args.state_dir)
+        paths = [image_path(args.data_dir, x) for x in images]
+        samples = state.samples(paths, images, labels)
+
+    if state is not None and _can_resume(state, samples, args):
+        history = _fit_incremental(model, args, state, samples)
+        mlflow.keras.log_model(model, artifact_path="model")
+    else:
+        if chief:
+            mlflow.log_param("training_mode", "full")
+        X_train, X_test, Y_train, Y_test = train_test_split(
+            images,
+            labels,
+            test_size=TEST_SIZE,
+            stratify=labels,
+            random_state=SPLIT_SEED,
+        )
+        if args.duplicates_report and chief:
+            _report_duplicates(args, X_train, X_test)
+        if samples is not None:
+            test_images = set(X_test)
+            for image, sample in samples.items():
+                sample["split"] = "test" if image in test_images else "train"
+
+        if args.features_cache:
+            history = _fit_head(model, args, X_train, X_test, Y_train, Y_test, samples)
+            # autolog has stored the head only, while serving expects raw images
+            mlflow.keras.log_model(model, artifact_path="model")
+        elif args.tfrecords:
+            history = _fit_records(model, args)
+        elif strategy is not None:
+            history = _fit_distributed(
+                model, strategy, args, X_train, X_test, Y_train, Y_test
+            )
+        else:
+            history = _fit(model, args, X_train, X_test, Y_train, Y_test)
+
+    if state is not None:
+        state.save(model, samples, args.head)
+
+    # written last, a failed run leaves the training set to be retrained on
+    if chief and args.fingerprint_path:
+        write_fingerprint(args.fingerprint_path, dataset_fingerprint)
+
+    # None when an incremental run had nothing to train on
+    if history is not None:
+        final_val_acc = history.history["val_acc"][-1]
+
+        logger.info("Validation Accuracy: %1.3f", final_val_acc)
+
+
+def _profiling(
+    args: argparse.Namespace, train_data, batch_size: int = BATCH_SIZE
+) -> Tuple[Any, List[tf.keras.callbacks.Callback]]:
+    """
+    The training input and the callbacks to fit with, profiled with --profile.
+    """
+    if not (args.profile and is_chief()):
+        return train_data, []
+    profiler = ThroughputProfiler(args.profile_every, batch_size)
+    return profiler.wrap(train_data), [profiler]
+
 
-    X_train, X_test, Y_train, Y_test = train_test_split(
-        images, labels, test_size=TEST_SIZE, stratify=labels, random_state=SPLIT_SEED
+def _report_duplicates(
+    args: argparse.Namespace, X_train: List[str], X_test: List[str]
+) -> None:
+    """
+    Log the near-duplicate clusters spanning both splits, their validation
+    images inflate val_acc.
+    """
+    images = X_train + X_test
+    index = DuplicateIndex()
+    paths = [image_path(args.data_dir, x) for x in images]
+    for image, value in zip(images, hash_images(paths, max(args.workers, 1))):
+        index.add(image, value)
+    train_images = set(X_train)
+    clusters = [
+        cluster
+        for cluster in index.clusters()
+        if 0 < sum(image in train_images for image in cluster) < len(cluster)
+    ]
+    leaked = sum(image not in train_images for cluster in clusters for image in cluster)
+    mlflow.log_metric("cross_split_duplicate_clusters", len(clusters))
+    mlflow.log_metric("leaked_validation_images", leaked)
+    logger.info(
+        "%d near-duplicate clusters span both splits, "
+        "%d of %d validation images have a copy in training",
+        len(clusters),
+        leaked,
+        len(X_test),
     )
+    if clusters:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            report = pathlib.Path(tmp_dir) / "cross_split_duplicates.json"
+            report.write_text(json.dumps(clusters, indent=2))
+            mlflow.log_artifact(str(report))
+
+
+def _fit(
+    model: tf.keras.Model,
+    args: argparse.Namespace,
+    X_train: List[str],
+    X_test: List[str],
+    Y_train: List[str],
+    Y_test: List[str],
+) -> tf.keras.callbacks.History:
+    image_cache = None
+    if args.image_cache:
+        image_cache = ImageShardCache(
+            args.image_cache, max_bytes=args.image_cache_bytes
+        )
 
     train_ds = DogsDataset(
         args.data_dir,
         X_train,
         Y_train,
         CLASS_ENCODING,
+        image_cache=image_cache,
+        seed=RD_SEED,
     )
     validation_ds = DogsDataset(
         args.data_dir,
         X_test,
         Y_test,
         CLASS_ENCODING,
+        image_cache=image_cache,
+        seed=RD_SEED,
     )
 
-    model = get_model()
+    logger.info("Training on %s", train_ds)
+
+    if args.workers:
+        with PrefetchLoader(
+            train_ds, args.workers, args.prefetch, args.use_processes
+        ) as train_loader, PrefetchLoader(
+            validation_ds, args.workers, args.prefetch, args.use_processes
+        ) as validation_loader:
+            train_data, callbacks = _profiling(args, iter(train_loader))
+            history = model.fit(
+                train_data,
+                steps_per_epoch=len(train_loader),
+                epochs=EPOCHS,
+                validation_data=iter(validation_loader),
+                validation_steps=len(validation_loader),
+                callbacks=callbacks,
+            )
+    else:
+        train_data, callbacks = _profiling(args, train_ds)
+        history = model.fit(
+            train_data,
+            epochs=EPOCHS,
+            validation_data=validation_ds,
+            callbacks=callbacks,
+        )
+    if image_cache is not None:
+        image_cache.flush()
+    return history
 
-    print(train_ds)
 
+def _fit_distributed(
+    model: tf.keras.Model,
+    strategy: tf.distribute.Strategy,
+    args: argparse.Namespace,
+    X_train: List[str],
+    X_test: List[str],
+    Y_train: List[str],
+    Y_test: List[str],
+) -> tf.keras.callbacks.History:
+    """
+    Fit on all workers at once. Every worker loads a disjoint shard of the data
+    and the global batch grows with the number of workers.
+    """
+    image_cache = None
+    if args.image_cache:
+        # the cache supports a single writer, every worker gets its own
+        image_cache = ImageShardCache(
+            args.image_cache / f"worker-{worker_index()}",
+            max_bytes=args.image_cache_bytes,
+        )
+
+    train_ds = DogsDataset(
+        args.data_dir,
+        X_train,
+        Y_train,
+        CLASS_ENCODING,
+        image_cache=image_cache,
+        seed=RD_SEED,
+    )
+    validation_ds = DogsDataset(
+        args.data_dir,
+        X_test,
+        Y_test,
+        CLASS_ENCODING,
+        image_cache=image_cache,
+        seed=RD_SEED,
+    )
+
+    global_batch_size = BATCH_SIZE * strategy.num_replicas_in_sync
+    train_data, callbacks = _profiling(
+        args, distribute(strategy, train_ds, global_batch_size), global_batch_size
+    )
     history = model.fit(
-        train_ds,
+        train_data,
+        steps_per_epoch=max(len(X_train) // global_batch_size, 1),
+        epochs=EPOCHS,
+        validation_data=distribute(strategy, validation_ds, global_batch_size),
+        validation_steps=max(len(X_test) // global_batch_size, 1),
+        callbacks=callbacks,
+    )
+    if image_cache is not None:
+        image_cache.flush()
+    return history
+
+
+def _fit_records(
+    model: tf.keras.Model, args: argparse.Namespace
+) -> tf.keras.callbacks.History:
+    """Stream the TFRecord shards written by `src/tfrecords.py`."""
+    train_data, callbacks = _profiling(args, records_dataset(args.tfrecords, "train"))
+    return model.fit(
+        train_data,
+        epochs=EPOCHS,
+        validation_data=records_dataset(args.tfrecords, "test", shuffle=False),
+        callbacks=callbacks,
+    )
+
+
+def _fit_head(
+    model: tf.keras.Model,
+    args: argparse.Namespace,
+    X_train: List[str],
+    X_test: List[str],
+    Y_train: List[str],
+    Y_test: List[str],
+    samples: Optional[Dict[str, Dict]] = None,
+) -> tf.keras.callbacks.History:
+    """
+    Run the frozen encoder once per image and fit only the head
+    on the cached encoder outputs. The content hashes of the incremental
+    training `samples` are reused instead of reading the images again.
+    """
+    cache = FeatureCache(args.features_cache, get_encoder(model))
+
+    def rows(images: List[str]) -> np.ndarray:
+        hashes = None if samples is None else [samples[x]["hash"] for x in images]
+        return cache.rows([image_path(args.data_dir, x) for x in images], hashes=hashes)
+
+    train_rows = rows(X_train)
+    test_rows = rows(X_test)
+    features = cache.features
+
+    train_ds = FeaturesDataset(features, train_rows, Y_train, CLASS_ENCODING)
+    validation_ds = FeaturesDataset(features, test_rows, Y_test, CLASS_ENCODING)
+
+    train_data, callbacks = _profiling(args, train_ds)
+    return get_head(model).fit(
+        train_data,
         epochs=EPOCHS,
         validation_data=validation_ds,
+        callbacks=callbacks,
     )
 
-    final_val_acc = history.history["val_acc"][-1]
 
-    print("Validation Accuracy: %1.3f" % (final_val_acc))
+def _can_resume(
+    state: TrainState, samples: Dict[str, Dict], args: argparse.Namespace
+) -> bool:
+    if not state.previous:
+        logger.info("No previous training state, training from scratch")
+        return False
+    if state.head != args.head:
+        logger.info(
+            "Previous run trained the %r head, training from scratch", state.head
+        )
+        return False
+    drift = state.drift(samples)
+    mlflow.log_metric("label_drift", drift)
+    if drift > args.drift_threshold:
+        logger.info("Label distribution drifted by %.3f, training from scratch", drift)
+        return False
+    return True
+
+
+def _fit_incremental(
+    model: tf.keras.Model,
+    args: argparse.Namespace,
+    state: TrainState,
+    samples: Dict[str, Dict],
+) -> Optional[tf.keras.callbacks.History]:
+    """
+    Warm-start from the weights of the previous run and fine-tune the head
+    for at most `args.incremental_steps` steps on the new samples, mixed with
+    replayed old ones. Only new images go through the encoder.
+    Without new or changed training samples the previous weights are kept
+    as they are and None is returned.
+    """
+    model.load_weights(str(state.weights_path))
+    changed = set(state.changed(samples))
+    mlflow.log_param("training_mode", "incremental")
+    mlflow.log_metric("new_samples", len(changed))
+    if not changed:
+        logger.info("No new or changed samples, keeping the previous weights")
+        return None
+    for image in changed:
+        if samples[image]["split"] is None:
+            samples[image]["split"] = hash_split(image, TEST_SIZE)
+
+    new_images, replayed = fine_tune_images(
+        samples, changed, args.incremental_steps * BATCH_SIZE, RD_SEED
+    )
+    if not new_images:
+        logger.info("No new training samples, keeping the previous weights")
+        return None
+    fit_images = new_images + replayed
+    test_images = [x for x, sample in samples.items() if sample["split"] == "test"]
+
+    logger.info(
+        "Fine-tuning on %d new and %d replayed images", len(new_images), len(replayed)
+    )
+
+    cache = FeatureCache(args.features_cache, get_encoder(model))
+
+    def rows(images: List[str]) -> np.ndarray:
+        return cache.rows(
+            [image_path(args.data_dir, x) for x in images],
+            hashes=[samples[x]["hash"] for x in images],
+        )
+
+    train_rows = rows(fit_images)
+    test_rows = rows(test_images)
+    features = cache.features
+
+    train_ds = FeaturesDataset(
+        features,
+        train_rows,
+        [samples[x]["label"] for x in fit_images],
+        CLASS_ENCODING,
+    )
+    validation_ds = FeaturesDataset(
+        features,
+        test_rows,
+        [samples[x]["label"] for x in test_images],
+        CLASS_ENCODING,
+    )
+    train_data, callbacks = _profiling(args, train_ds)
+    return get_head(model).fit(
+        train_data,
+        epochs=1,
+        steps_per_epoch=min(len(train_ds), args.incremental_steps),
+        validation_data=validation_ds,
+        callbacks=callbacks,
+    )
 
 
 def get_parser() -> argparse.ArgumentParser:
@@ -76,6 +444,112 @@ def get_parser() -> argparse.ArgumentParser:
         type=pathlib.Path,
         help="Path to the dataset description file",
     )
+    parser.add_argument(
+        "--head",
+        default=HEAD,
+        choices=sorted(HEADS),
+        help="Classifier head on top of the encoder, MODEL_HEAD env by default",
+    )
+    parser.add_argument(
+        "--features_cache",
+        type=pathlib.Path,
+        help="Path to the encoder features cache. "
+        "If set, the encoder runs once per image and only the head is trained",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Fine-tune the model of the previous run on new samples only, "
+        "unless the label distribution drifted. Requires --features_cache",
+    )
+    parser.add_argument(
+        "--state_dir",
+        type=pathlib.Path,
+        help="Path to keep the samples manifest and weights of the last run in",
+    )
+    parser.add_argument(
+        "--incremental_steps",
+        default=INCREMENTAL_STEPS,
+        type=int,
+        help="Maximum number of fine-tuning steps of an incremental run",
+    )
+    parser.add_argument(
+        "--drift_threshold",
+        default=DRIFT_THRESHOLD,
+        type=float,
+        help="Label distribution distance from the last run forcing a full retrain",
+    )
+    parser.add_argument(
+        "--fingerprint_path",
+        type=pathlib.Path,
+        help="File to record the fingerprint of the trained on dataset in, "
+        "checked by the Pachyderm pipeline to skip retrains",
+    )
+    parser.add_argument(
+        "--duplicates_report",
+        action="store_true",
+        help="Log near-duplicate images found in both the train and validation "
+        "splits",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Log the input wait and train step times, images per second "
+        "and peak RSS to MLflow",
+    )
+    parser.add_argument(
+        "--profile_every",
+        default=PROFILE_LOG_EVERY,
+        type=int,
+        help="Number of batches summed up per profile log",
+    )
+    parser.add_argument(
+        "--log_level",
+        default="INFO",
+        choices=("DEBUG", "INFO", "WARNING", "ERROR"),
+    )
+    parser.add_argument(
+        "--tfrecords",
+        type=pathlib.Path,
+        help="Path to the TFRecord shards exported by src/tfrecords.py. "
+        "If set, training streams them instead of reading images one by one; "
+        "they must be exported from --data_description",
+    )
+    parser.add_argument(
+        "--distributed",
+        action="store_true",
+        help="Train data-parallel on the workers listed in TF_CONFIG, "
+        "see src/launch_workers.py",
+    )
+    parser.add_argument(
+        "--image_cache",
+        type=pathlib.Path,
+        help="Path to the decoded image cache. "
+        "If set, every image is decoded and resized only once",
+    )
+    parser.add_argument(
+        "--image_cache_bytes",
+        default=IMAGE_CACHE_MAX_BYTES,
+        type=int,
+        help="Disk budget of the decoded image cache",
+    )
+    parser.add_argument(
+        "--workers",
+        default=LOADER_WORKERS,
+        type=int,
+        help="Number of workers loading batches ahead of training, 0 to load in place",
+    )
+    parser.add_argument(
+        "--prefetch",
+        default=PREFETCH_BATCHES,
+        type=int,
+        help="Maximum number of batches loaded ahead of training",
+    )
+    parser.add_argument(
+        "--use_processes",
+        action="store_true",
+        help="Load batches in worker processes instead of threads",
+    )
     return parser
 
 
@@ -91,11 +565,21 @@ def get_args(provided_args: Optional[List[str]] = None) -> argparse.Namespace:
         raise ValueError(f"{args.data_description} does not exist!")
     if not args.data_description.is_file():
         raise ValueError(f"{args.data_dir} is not a file!")
+    if args.incremental and not (args.features_cache and args.state_dir):
+        raise ValueError("--incremental requires --features_cache and --state_dir")
+    if args.distributed and args.features_cache:
+        raise ValueError("--distributed can not be combined with --features_cache")
+    if args.tfrecords and (args.features_cache or args.distributed):
+        raise ValueError(
+            "--tfrecords can not be combined with --features_cache or --distributed"
+        )
 
     return args
 
 
 if __name__ == "__main__":
-    mlflow.keras.autolog()
     args = get_args()
+    logging.basicConfig(level=args.log_level)
+    if is_chief():
+        mlflow.keras.autolog()
     train(args)
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import src.dedup as dedup
+from src.dedup import DuplicateIndex, dhash, hamming
+
+
+def _random_hashes(seed: int = 0, count: int = 300) -> list:
+    rng = np.random.RandomState(seed)
+    hashes = [int(rng.randint(0, 2 ** 63)) * 2 + 1 for _ in range(count)]
+    # near copies of the first images, a few bits flipped
+    for value in hashes[:100]:
+        bits = rng.choice(64, size=rng.randint(0, 8), replace=False)
+        hashes.append(value ^ sum(1 << int(bit) for bit in bits))
+    return hashes
+
+
+def _brute_force(hashes: list, max_distance: int) -> set:
+    return {
+        (i, j)
+        for i in range(len(hashes))
+        for j in range(i + 1, len(hashes))
+        if bin(hashes[i] ^ hashes[j]).count("1") <= max_distance
+    }
+
+
+@pytest.mark.parametrize("block_size", [1, 64, dedup.BLOCK_SIZE])
+@pytest.mark.parametrize("max_distance", [0, 3, 7])
+def test_pairs_match_brute_force(monkeypatch, block_size, max_distance):
+    monkeypatch.setattr(dedup, "BLOCK_SIZE", block_size)
+    hashes = _random_hashes()
+    index = DuplicateIndex(max_distance)
+    for i, value in enumerate(hashes):
+        index.add(str(i), value)
+    found = {tuple(sorted(pair)) for pair in index.pairs()}
+    assert found == _brute_force(hashes, max_distance)
+
+
+def test_near_and_clusters():
+    index = DuplicateIndex(2)
+    for key, value in [("a", 0b0000), ("b", 0b0011), ("c", 0b1111), ("d", 0b1111 << 8)]:
+        index.add(key, value)
+    assert index.near(0b0001) == ["a", "b"]
+    assert sorted(map(sorted, index.clusters())) == [["a", "b", "c"]]
+
+
+def test_max_distance_bound():
+    with pytest.raises(ValueError):
+        DuplicateIndex(dedup.BANDS)
+
+
+def test_hamming_broadcasts():
+    hashes = np.array([0, 1, 2 ** 64 - 1], dtype=np.uint64)
+    assert hamming(hashes, 0).tolist() == [0, 1, 64]
+    assert hamming(hashes[:, np.newaxis], hashes).shape == (3, 3)
+
+
+def test_dhash_of_a_resized_copy(tmp_path):
+    rng = np.random.RandomState(0)
+    pixels = rng.randint(0, 256, size=(9, 12, 3), dtype=np.uint8)
+    image = Image.fromarray(pixels).resize((360, 270), Image.BILINEAR)
+    image.save(tmp_path / "large.png")
+    image.resize((180, 135), Image.BILINEAR).save(tmp_path / "small.png")
+    distance = bin(dhash(tmp_path / "large.png") ^ dhash(tmp_path / "small.png"))
+    assert distance.count("1") <= dedup.DEDUP_MAX_DISTANCE
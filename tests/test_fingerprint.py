@@ -0,0 +1,42 @@
+import json
+
+from src.fingerprint import fingerprint, read_fingerprint, write_fingerprint
+from src.ls_export import iter_labeled
+
+
+def _task(image, label, annotation_id):
+    return {
+        "id": annotation_id,
+        "data": {"image": image},
+        "annotations": [
+            {"id": annotation_id, "result": [{"value": {"choices": [label]}}]}
+        ],
+    }
+
+
+def test_fingerprint_of_the_training_pairs_only(tmp_path):
+    first = tmp_path / "first.json"
+    second = tmp_path / "second.json"
+    first.write_text(json.dumps([_task("a.jpg", "dog", 1), _task("b.jpg", "cat", 2)]))
+    second.write_text(json.dumps([_task("a.jpg", "dog", 3), _task("b.jpg", "cat", 4)]))
+    assert fingerprint(iter_labeled(first)) == fingerprint(iter_labeled(second))
+
+
+def test_fingerprint_changes_with_the_pairs():
+    pairs = [("a.jpg", "dog"), ("b.jpg", "cat")]
+    value = fingerprint(pairs)
+    assert fingerprint(pairs[::-1]) != value
+    assert fingerprint([("a.jpg", "cat"), ("b.jpg", "cat")]) != value
+    assert fingerprint(pairs[:1]) != value
+    # pairs are delimited, so joining their fields differently changes the hash
+    assert fingerprint([("a.jpgd", "og")]) != fingerprint([("a.jpg", "dog")])
+
+
+def test_write_and_read_fingerprint(tmp_path):
+    path = tmp_path / "state" / "last_fingerprint.txt"
+    assert read_fingerprint(path) is None
+    write_fingerprint(path, "abc")
+    assert read_fingerprint(path) == "abc"
+    assert not list(path.parent.glob("*.tmp"))
+    path.write_text("\n")
+    assert read_fingerprint(path) is None
@@ -0,0 +1,89 @@
+import json
+
+import numpy as np
+import pytest
+
+from config.preprocessing import INPUT_SIZE
+from src.image_cache import ImageShardCache
+
+
+def _image(value: int) -> np.ndarray:
+    return np.full((*INPUT_SIZE, 3), value, dtype=np.uint8)
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "images" / "dog.jpg"
+    path.parent.mkdir()
+    path.write_bytes(b"jpeg")
+    return path
+
+
+def test_put_flush_reopen(tmp_path, source):
+    cache = ImageShardCache(tmp_path / "cache", shard_size=2)
+    assert cache.lookup([source]) == [None]
+    cache.put(source, _image(7))
+    cache.flush()
+
+    reopened = ImageShardCache(tmp_path / "cache", shard_size=2)
+    slots = reopened.lookup([source])
+    assert slots == [(0, 0)]
+    out = np.zeros((1, *INPUT_SIZE, 3), dtype=np.uint8)
+    reopened.read(slots, out)
+    assert (out == 7).all()
+
+
+def test_changed_source_is_a_miss(tmp_path, source):
+    cache = ImageShardCache(tmp_path / "cache", shard_size=2)
+    cache.put(source, _image(7))
+    source.write_bytes(b"another jpeg")
+    assert cache.lookup([source]) == [None]
+
+
+def test_max_bytes_stops_caching(tmp_path, source):
+    cache = ImageShardCache(tmp_path / "cache", max_bytes=0, shard_size=2)
+    cache.put(source, _image(7))
+    assert cache.lookup([source]) == [None]
+
+
+def test_outdated_cache_wipes_only_its_files(tmp_path, source):
+    root = tmp_path / "cache"
+    cache = ImageShardCache(root, shard_size=2)
+    cache.put(source, _image(7))
+    cache.flush()
+    notes = root / "notes.txt"
+    notes.write_text("kept")
+
+    reopened = ImageShardCache(root, shard_size=4)
+    assert reopened.lookup([source]) == [None]
+    assert not list(root.glob("shard-*.u8"))
+    assert not (root / "index.json").exists()
+    assert notes.read_text() == "kept"
+
+
+def test_folder_without_index_is_refused(tmp_path):
+    root = tmp_path / "data"
+    root.mkdir()
+    (root / "result.json").write_text("[]")
+    with pytest.raises(ValueError):
+        ImageShardCache(root)
+    assert (root / "result.json").exists()
+
+
+def test_invalid_index_is_refused(tmp_path):
+    root = tmp_path / "cache"
+    root.mkdir()
+    (root / "index.json").write_text(json.dumps({"some": "file"}))
+    with pytest.raises(ValueError):
+        ImageShardCache(root)
+
+
+def test_shards_without_index_are_dropped(tmp_path, source):
+    root = tmp_path / "cache"
+    cache = ImageShardCache(root, shard_size=2)
+    cache.put(source, _image(7))
+    del cache
+
+    reopened = ImageShardCache(root, shard_size=2)
+    assert reopened.lookup([source]) == [None]
+    assert not list(root.glob("shard-*.u8"))
@@ -0,0 +1,59 @@
+import pytest
+
+from src.incremental import TrainState, fine_tune_images, hash_split, label_drift
+
+
+def test_label_drift():
+    assert label_drift(["a", "b"], ["b", "a"]) == 0.0
+    assert label_drift(["a", "a"], ["b", "b"]) == 1.0
+    assert label_drift(["a", "b"], ["a", "a", "a", "b"]) == pytest.approx(0.25)
+    assert label_drift([], ["a"]) == 1.0
+
+
+def test_hash_split_is_stable_and_follows_test_size():
+    images = [f"n02085620_{i}.jpg" for i in range(2000)]
+    splits = [hash_split(image, 0.2) for image in images]
+    assert splits == [hash_split(image, 0.2) for image in images]
+    assert set(splits) == {"train", "test"}
+    assert splits.count("test") / len(splits) == pytest.approx(0.2, abs=0.03)
+    assert {hash_split(image, 0.0) for image in images} == {"train"}
+
+
+def test_samples_and_changed(tmp_path):
+    data_dir = tmp_path / "Images"
+    data_dir.mkdir()
+    for name in ("a.jpg", "b.jpg"):
+        (data_dir / name).write_bytes(name.encode())
+    state = TrainState(tmp_path / "state")
+    paths = [data_dir / "a.jpg", data_dir / "b.jpg"]
+    samples = state.samples(paths, ["a.jpg", "b.jpg"], ["dog", "dog"])
+    assert sorted(state.changed(samples)) == ["a.jpg", "b.jpg"]
+    assert {sample["split"] for sample in samples.values()} == {None}
+
+    for sample in samples.values():
+        sample["split"] = "train"
+    state.previous = samples
+    (data_dir / "b.jpg").write_bytes(b"edited")
+    samples = state.samples(paths, ["a.jpg", "b.jpg"], ["dog", "cat"])
+    assert state.changed(samples) == ["b.jpg"]
+    assert samples["a.jpg"]["split"] == "train"
+    assert samples["b.jpg"]["split"] is None
+
+
+def _samples(splits):
+    return {f"{i}.jpg": {"split": split} for i, split in enumerate(splits)}
+
+
+def test_fine_tune_images_replays_old_ones():
+    samples = _samples(["train"] * 10 + ["test"] * 2)
+    new, replayed = fine_tune_images(samples, ["0.jpg", "10.jpg"], budget=4, seed=1)
+    assert new == ["0.jpg"]
+    assert len(replayed) == 3
+    assert set(replayed) <= {f"{i}.jpg" for i in range(1, 10)}
+    assert fine_tune_images(samples, ["0.jpg"], budget=4, seed=1)[1] == replayed
+
+
+def test_fine_tune_images_without_new_training_images():
+    samples = _samples(["train"] * 10 + ["test"] * 2)
+    assert fine_tune_images(samples, ["10.jpg", "11.jpg"], 4, seed=1) == ([], [])
+    assert fine_tune_images(samples, [], 4, seed=1) == ([], [])
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import src.inference as inference
+from src.inference import TFLiteBackend
+
+
+class FakeInterpreter:
+    """Scores every image by the sum of its pixels, counting allocations."""
+
+    allocations = 0
+
+    def __init__(self, model_path, num_threads=None):
+        self.shape = [1, 2, 2]
+
+    def get_input_details(self):
+        return [
+            {
+                "index": 0,
+                "shape": np.array(self.shape),
+                "dtype": np.float32,
+                "quantization": (0.0, 0),
+            }
+        ]
+
+    def get_output_details(self):
+        return [{"index": 1, "dtype": np.float32, "quantization": (0.0, 0)}]
+
+    def resize_tensor_input(self, index, shape):
+        self.shape = list(shape)
+
+    def allocate_tensors(self):
+        FakeInterpreter.allocations += 1
+
+    def set_tensor(self, index, x):
+        assert list(x.shape) == self.shape
+        self.x = x
+
+    def invoke(self):
+        self.output = self.x.reshape(len(self.x), -1).sum(axis=1, keepdims=True)
+
+    def get_tensor(self, index):
+        return self.output
+
+
+@pytest.fixture(autouse=True)
+def fake_interpreter(monkeypatch):
+    FakeInterpreter.allocations = 0
+    monkeypatch.setattr(inference, "_interpreter_class", lambda: FakeInterpreter)
+
+
+def _images(n):
+    return np.arange(n * 4, dtype=np.float32).reshape(n, 2, 2)
+
+
+def _expected(x):
+    return x.reshape(len(x), -1).sum(axis=1, keepdims=True)
+
+
+def test_fixed_batch_sizes_pad_and_slice():
+    backend = TFLiteBackend("model.tflite", batch_sizes=(1, 4))
+    for n in (1, 3, 2, 4, 1, 9, 3):
+        x = _images(n)
+        np.testing.assert_array_equal(backend(x), _expected(x))
+    # one allocation per batch size, whatever the sequence of calls
+    assert FakeInterpreter.allocations == 2
+
+
+def test_without_batch_sizes_every_size_is_allocated():
+    backend = TFLiteBackend("model.tflite")
+    for n in (1, 3, 3, 2):
+        x = _images(n)
+        np.testing.assert_array_equal(backend(x), _expected(x))
+    assert FakeInterpreter.allocations == 3
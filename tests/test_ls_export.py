@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from src.ls_export import iter_labeled, iter_tasks, task_label
+
+
+def _task(image, label, cancelled=False):
+    return {
+        "data": {"image": image},
+        "annotations": [
+            {
+                "was_cancelled": cancelled,
+                "result": [{"value": {"choices": [label]}}],
+            }
+        ],
+    }
+
+
+TASKS = [
+    _task("a.jpg", "dog"),
+    {"data": {"image": "b.jpg"}, "annotations": []},
+    _task("c.jpg", 'cat, "or" ]dog['),
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024 * 1024])
+def test_iter_tasks_across_chunks(tmp_path, chunk_size):
+    path = tmp_path / "result.json"
+    path.write_text(json.dumps(TASKS, indent=2))
+    assert list(iter_tasks(path, chunk_size=chunk_size)) == TASKS
+
+
+def test_iter_labeled_skips_unlabeled_tasks(tmp_path):
+    path = tmp_path / "result.json"
+    path.write_text(json.dumps(TASKS))
+    assert list(iter_labeled(path)) == [
+        ("a.jpg", "dog"),
+        ("c.jpg", 'cat, "or" ]dog['),
+    ]
+
+
+def test_empty_export(tmp_path):
+    path = tmp_path / "result.json"
+    path.write_text(" \n")
+    with pytest.raises(ValueError, match="empty"):
+        list(iter_tasks(path))
+    path.write_text("[]")
+    assert list(iter_tasks(path)) == []
+
+
+@pytest.mark.parametrize("cut", [1, 20, -1])
+def test_truncated_export(tmp_path, cut):
+    path = tmp_path / "result.json"
+    path.write_text(json.dumps(TASKS)[:cut])
+    with pytest.raises(ValueError):
+        list(iter_tasks(path, chunk_size=8))
+
+
+def test_not_a_list(tmp_path):
+    path = tmp_path / "result.json"
+    path.write_text(json.dumps(TASKS[0]))
+    with pytest.raises(ValueError, match="not a list"):
+        list(iter_tasks(path))
+
+
+def test_task_label_skips_cancelled_annotations():
+    task = _task("a.jpg", "cat", cancelled=True)
+    assert task_label(task) is None
+    task["annotations"].append(_task("a.jpg", "dog")["annotations"][0])
+    assert task_label(task) == "dog"
+    assert task_label({"data": {"image": "a.jpg"}}) is None
@@ -0,0 +1,42 @@
+import io
+
+import numpy as np
+
+from src.prediction_cache import PredictionCache
+
+
+def test_key_depends_on_dtype_and_shape():
+    cache = PredictionCache(max_entries=10, max_bytes=1024)
+    x = np.arange(12, dtype=np.uint8)
+    keys = {
+        cache.key(x),
+        cache.key(x.reshape(3, 4)),
+        cache.key(x.reshape(4, 3)),
+        cache.key(x.view(np.int8)),
+        cache.key(x.tobytes()),
+    }
+    assert len(keys) == 5
+    assert cache.key(x.reshape(3, 4)) == cache.key(x.reshape(3, 4).copy())
+
+
+def test_key_of_bytes_and_file_objects():
+    cache = PredictionCache(max_entries=10, max_bytes=1024)
+    assert cache.key(b"jpeg") == cache.key(io.BytesIO(b"jpeg"))
+    assert cache.key("jpeg") is None
+    assert cache.key(np.array([object()])) is None
+    assert PredictionCache(max_entries=0, max_bytes=1024).key(b"jpeg") is None
+
+
+def test_lru_eviction_and_model_switch():
+    cache = PredictionCache(max_entries=2, max_bytes=1024 ** 2)
+    cache.set_model("a")
+    for payload in (b"1", b"2", b"3"):
+        cache.put(cache.key(payload), payload)
+    assert cache.get(cache.key(b"1")) is None
+    assert cache.get(cache.key(b"3")) == b"3"
+    assert cache.evictions == 1
+
+    cache.put(cache.key(b"4"), b"4", model_id="b")
+    assert cache.get(cache.key(b"4")) is None
+    cache.set_model("b")
+    assert len(cache) == 0
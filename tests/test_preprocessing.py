@@ -0,0 +1,55 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from src.preprocessing import decode_image, img_to_numpy
+
+
+def _rotated_jpeg() -> bytes:
+    exif = Image.Exif()
+    exif[0x0112] = 6  # orientation: rotate 90 degrees clockwise to display
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 32), "white").save(buffer, "JPEG", exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def test_exif_orientation_applies_to_every_input(tmp_path):
+    data = _rotated_jpeg()
+    path = tmp_path / "dog.jpg"
+    path.write_bytes(data)
+    decoded = [
+        decode_image(im, (32, 32)) for im in (data, io.BytesIO(data), path, str(path))
+    ]
+    assert [img.size for img in decoded] == [(32, 64)] * 4
+    for img in decoded[1:]:
+        assert np.array_equal(np.asarray(img), np.asarray(decoded[0]))
+
+
+def _jpeg(pixels: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def _draft_difference(pixels: np.ndarray) -> float:
+    data = _jpeg(pixels)
+    full = img_to_numpy(data, (224, 224), draft=False)
+    draft = img_to_numpy(data, (224, 224), draft=True)
+    return float(np.abs(full - draft).mean())
+
+
+def test_draft_decoding_tolerance():
+    rng = np.random.RandomState(0)
+    noise = rng.randint(0, 256, size=(1000, 1200, 3), dtype=np.uint8)
+    assert 35 < _draft_difference(noise) < 45
+    y, x = np.mgrid[0:1000, 0:1200]
+    gradients = np.stack([x / 1200, y / 1000, (x + y) / 2200], axis=-1) * 255
+    assert _draft_difference(gradients.astype(np.uint8)) < 0.5
+
+
+def test_draft_decoding_of_small_images_is_exact():
+    rng = np.random.RandomState(0)
+    # below twice the target size, the decoder does not downscale
+    small = rng.randint(0, 256, size=(375, 500, 3), dtype=np.uint8)
+    assert _draft_difference(small) == 0.0
@@ -0,0 +1,34 @@
+import json
+
+from src.score import scored_images
+
+
+def _line(path: str) -> bytes:
+    return (json.dumps({"data": {}, "meta": {"path": path}}) + "\n").encode()
+
+
+def test_missing_output(tmp_path):
+    assert scored_images(tmp_path / "predictions.jsonl") == set()
+
+
+def test_complete_output_is_kept(tmp_path):
+    output = tmp_path / "predictions.jsonl"
+    content = _line("a.jpg") + _line("b.jpg")
+    output.write_bytes(content)
+    assert scored_images(output) == {"a.jpg", "b.jpg"}
+    assert output.read_bytes() == content
+
+
+def test_partial_last_line_is_cut_off(tmp_path):
+    output = tmp_path / "predictions.jsonl"
+    complete = _line("a.jpg") + _line("b.jpg")
+    output.write_bytes(complete + _line("c.jpg")[:-10])
+    assert scored_images(output) == {"a.jpg", "b.jpg"}
+    assert output.read_bytes() == complete
+
+
+def test_last_line_without_newline_is_cut_off(tmp_path):
+    output = tmp_path / "predictions.jsonl"
+    output.write_bytes(_line("a.jpg") + _line("b.jpg")[:-1])
+    assert scored_images(output) == {"a.jpg"}
+    assert output.read_bytes() == _line("a.jpg")
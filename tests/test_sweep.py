@@ -0,0 +1,41 @@
+import math
+
+import pytest
+
+pytest.importorskip("tensorflow")
+pytest.importorskip("mlflow")
+
+from src.sweep import get_args, rung_epochs, sample_trials  # noqa: E402
+
+
+ARGS = ["-d", "data/Images", "-f", "data/result.json", "--features_cache", "cache"]
+
+
+@pytest.mark.parametrize(
+    "min_epochs, max_epochs, eta, expected",
+    [
+        (1, 9, 3, [1, 3, 9]),
+        (1, 10, 3, [1, 3, 9, 10]),
+        (1, 8, 2, [1, 2, 4, 8]),
+        (2, 5, 3, [2, 5]),
+        (4, 4, 3, [4]),
+    ],
+)
+def test_rung_epochs(min_epochs, max_epochs, eta, expected):
+    assert rung_epochs(min_epochs, max_epochs, eta) == expected
+
+
+def test_sample_trials_is_seeded_and_in_range():
+    args = get_args(ARGS + ["--trials", "20", "--lr_min", "1e-4", "--lr_max", "1e-2"])
+    trials = sample_trials(args)
+    assert trials == sample_trials(args)
+    assert len(trials) == 20
+    for trial in trials:
+        assert trial["head"] in args.heads
+        assert trial["batch_size"] in args.batch_sizes
+        assert -4 <= math.log10(trial["learning_rate"]) <= -2
+
+
+def test_eta_below_two_is_rejected():
+    with pytest.raises(ValueError):
+        get_args(ARGS + ["--eta", "1"])